@@ -1,11 +1,12 @@
+import os
+import sys
+
 import streamlit as st
-import zxingcpp
-from PIL import Image
-import io
 
-def go_to(page_name):
-    st.session_state.page = page_name
-    st.rerun()
+# スキャン画面の部品は main/ と共通（main/scan.py）
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "main"))
+from scan import go_to, scan_code_input, select_prefecture, make_character, remember_character
+from jan import normalize_jan, explain_invalid
 
 def main_app():
     name_to_display = st.session_state.get("full_name", st.session_state.user.email)
@@ -48,60 +49,34 @@ def main_app():
     # --- スキャン画面 ---
     elif st.session_state.page == "scan":
         st.title("📷 バーコードスキャン")
-        img_file = st.camera_input("JANコードを撮影してください")
-
-        digits, result = None, None
-        if img_file:
-            img = Image.open(io.BytesIO(img_file.getvalue()))
-            result = zxingcpp.read_barcode(img)
-            if result:
-                digits = result.text
-                st.success(f"読み取ったコード: {digits} (種類: {result.format})")
-            else:
-                st.warning("バーコードの読み取りに失敗しました")
 
-        # 数字入力
-        col1, col2 = st.columns([3,1])
-        with col1:
-            digits_input = st.text_input(
-                "数字を入力（読み取ったコードがあれば自動入力されます）",
-                value=digits or ""
-            )
-        with col2:
-            st.write("")  # 縦位置調整
-            number_ok = st.button("✅ 数字OK")
+        # バーコード読み取り・数字入力（main/login.py と共通）
+        digits_input, symbology = scan_code_input()
 
         # 都道府県選択
-        prefectures = [
-            "北海道","青森県","岩手県","宮城県","秋田県","山形県","福島県",
-            "茨城県","栃木県","群馬県","埼玉県","千葉県","東京都","神奈川県",
-            "新潟県","富山県","石川県","福井県","山梨県","長野県",
-            "岐阜県","静岡県","愛知県","三重県",
-            "滋賀県","京都府","大阪府","兵庫県","奈良県","和歌山県",
-            "鳥取県","島根県","岡山県","広島県","山口県",
-            "徳島県","香川県","愛媛県","高知県",
-            "福岡県","佐賀県","長崎県","熊本県","大分県","宮崎県","鹿児島県",
-            "沖縄県"
-        ]
-        selected_pref = st.selectbox("都道府県を選択", prefectures, index=12)
+        selected_pref = select_prefecture()
 
         col1, col2, col3 = st.columns([1,2,1])
         with col2:
             generate_btn = st.button("✨ 生成する", use_container_width=True)
 
-        if number_ok or generate_btn:
-            if digits_input.strip():
-                character = {
-                    "name": f"キャラ_{len(st.session_state.characters)+1}",
-                    "power": len(digits_input) + prefectures.index(selected_pref),
-                    "barcode": digits_input,
-                    "region": selected_pref,
-                    "type": "OCR" if not result else result.format
-                }
-                st.session_state.characters.append(character)
-                st.success(f"🎉 新キャラを獲得！: {character}")
-            else:
+        if generate_btn:
+            # main/login.py と同じく、不正なJANではキャラを作らない
+            jan = normalize_jan(digits_input, symbology)
+            if not digits_input.strip():
                 st.error("数字が入力されていません")
+            elif not jan:
+                st.error(explain_invalid(digits_input))
+            else:
+                # 戦闘力は main/login.py と同じく JAN から計算する
+                character = make_character(
+                    f"キャラ_{len(st.session_state.characters)+1}",
+                    jan,
+                    selected_pref,
+                    symbology or "OCR",
+                )
+                remember_character(character)
+                st.success(f"🎉 新キャラを獲得！: {character}")
 
         if st.button("⬅️ メイン画面へ戻る"):
             go_to("main")
@@ -114,7 +89,7 @@ def main_app():
                 st.write(f"### {idx}. {char['name']}")
                 st.write(f"バーコード: {char['barcode']} (種類: {char['type']})")
                 st.write(f"地域: {char['region']}")
-                st.write(f"強さ: {char['power']}")
+                st.write(f"戦闘力: {char['combat_power']}")
                 st.divider()
         else:
             st.info("まだキャラクターがいません。スキャンしてみましょう！")
@@ -0,0 +1,183 @@
+#負荷試験のドライバー
+# モックサーバーを起動し、Streamlit の AppTest で N 人のプレイヤーを同時に動かす。
+# 各プレイヤーは ログイン → キャラ生成画面 → 生成 → 保存 → 図鑑 を繰り返し、
+# 画面ごとのレイテンシ（p50/p90/p99）とスループットを表示する。
+#
+# 例: python loadtest/driver.py --players 20 --iterations 3 --latency stability=2000:500
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from mock_servers import MockUpstreams, add_profile_arguments, parse_profile_args
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(ROOT, "main", "login.py")
+sys.path.insert(0, os.path.join(ROOT, "main"))
+
+from jan import check_digit  # noqa: E402
+
+STEPS = ("login", "scan", "generate", "save", "zukan")
+
+
+def random_jan() -> str:
+    body = "49" + "".join(random.choice("0123456789") for _ in range(10))
+    return body + str(check_digit(body))
+
+
+class StepFailed(Exception):
+    pass
+
+
+def _button(at, label: str):
+    for button in at.button:
+        if button.label == label:
+            return button
+    raise StepFailed(f"ボタンが見つかりません: {label}")
+
+
+def _check(at, step: str):
+    if at.exception:
+        raise StepFailed(f"{step}: {at.exception[0].message}")
+    errors = [e.value for e in at.error]
+    if errors:
+        raise StepFailed(f"{step}: {errors[0]}")
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.failures = defaultdict(int)
+        self.failure_samples = []
+        self.completed = 0
+
+    def timed(self, step: str, action):
+        started = time.perf_counter()
+        at = action()
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            self.latencies[step].append(elapsed)
+        _check(at, step)
+        return at
+
+    def fail(self, step: str, message: str):
+        with self.lock:
+            self.failures[step] += 1
+            if len(self.failure_samples) < 10:
+                self.failure_samples.append(message)
+
+
+def play(player_no: int, iterations: int, recorder: Recorder, timeout: float):
+    """1人のプレイヤーのシナリオ"""
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+    at.run()
+    step = "login"
+    try:
+        at.text_input(key="login_email").input(f"player{player_no}@example.com")
+        at.text_input(key="login_password").input("password")
+        recorder.timed("login", lambda: _button(at, "ログインする").click().run())
+
+        for _ in range(iterations):
+            step = "scan"
+            recorder.timed("scan", lambda: _button(at, "🎨 キャラ生成").click().run())
+
+            step = "generate"
+            at.text_input[0].input(random_jan())
+            recorder.timed("generate", lambda: _button(at, "✨ 生成する").click().run())
+
+            step = "save"
+            recorder.timed("save", lambda: _button(at, "💾 保存する").click().run())
+            _button(at, "⬅️ メイン画面へ戻る").click().run()
+
+            step = "zukan"
+            recorder.timed("zukan", lambda: _button(at, "📖 キャラ図鑑").click().run())
+            _button(at, "⬅️ メイン画面へ戻る").click().run()
+            with recorder.lock:
+                recorder.completed += 1
+    except Exception as e:
+        recorder.fail(step, f"player{player_no} {step}: {e}")
+
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def build_report(recorder: Recorder, elapsed: float, mocks: MockUpstreams) -> dict:
+    steps = {}
+    for step in STEPS:
+        values = recorder.latencies.get(step, [])
+        steps[step] = {
+            "count": len(values),
+            "failures": recorder.failures.get(step, 0),
+            "mean": statistics.fmean(values) if values else 0.0,
+            "p50": percentile(values, 50),
+            "p90": percentile(values, 90),
+            "p99": percentile(values, 99),
+            "max": max(values) if values else 0.0,
+        }
+    return {
+        "elapsed_s": elapsed,
+        "completed_walks": recorder.completed,
+        "walks_per_min": recorder.completed / elapsed * 60 if elapsed else 0.0,
+        "steps": steps,
+        "upstream_requests": dict(mocks.state.requests),
+        "upstream_errors": dict(mocks.state.errors),
+        "failure_samples": recorder.failure_samples,
+    }
+
+
+def print_report(report: dict):
+    print(f"\n所要時間: {report['elapsed_s']:.1f}s  完了したシナリオ: {report['completed_walks']}"
+          f"  スループット: {report['walks_per_min']:.1f} 回/分")
+    print(f"{'画面':<10}{'件数':>6}{'失敗':>6}{'平均':>9}{'p50':>9}{'p90':>9}{'p99':>9}{'最大':>9}")
+    for step, s in report["steps"].items():
+        print(f"{step:<10}{s['count']:>6}{s['failures']:>6}{s['mean']:>9.3f}{s['p50']:>9.3f}"
+              f"{s['p90']:>9.3f}{s['p99']:>9.3f}{s['max']:>9.3f}")
+    print(f"外部APIリクエスト数: {report['upstream_requests']}")
+    print(f"外部APIエラー数: {report['upstream_errors']}")
+    for sample in report["failure_samples"]:
+        print(f"  失敗例: {sample}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="モックAPIに対して同時プレイヤーを走らせる負荷試験")
+    parser.add_argument("--players", type=int, default=10, help="同時プレイヤー数")
+    parser.add_argument("--iterations", type=int, default=1, help="1人あたりの 生成→保存→図鑑 の回数")
+    parser.add_argument("--timeout", type=float, default=120, help="1回の画面実行のタイムアウト（秒）")
+    parser.add_argument("--json", help="結果をJSONで保存するパス")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    profiles = parse_profile_args(args.latency, args.error_rate)
+    with MockUpstreams(profiles, png_size=args.png_size) as mocks:
+        os.environ.update(mocks.env())
+        recorder = Recorder()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.players) as pool:
+            for player_no in range(args.players):
+                pool.submit(play, player_no, args.iterations, recorder, args.timeout)
+        elapsed = time.perf_counter() - started
+        report = build_report(recorder, elapsed, mocks)
+
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
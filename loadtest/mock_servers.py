@@ -0,0 +1,462 @@
+#負荷試験用のローカルモックサーバー
+# Supabase（auth / rest / storage）、OpenAI、Stability AI、jancodelookup の
+# APIの形だけを真似して、遅延とエラー率を設定できるようにしたもの。
+#
+# 単体起動:  python loadtest/mock_servers.py --latency openai=800:200 --error-rate stability=0.05
+# （起動後に表示される環境変数をセットして streamlit run main/login.py）
+
+import argparse
+import base64
+import io
+import json
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+from PIL import Image
+
+SERVICES = ("supabase", "openai", "stability", "jancode")
+
+
+@dataclass
+class Profile:
+    """1つのモックサーバーの遅延・エラーの設定"""
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    error_rate: float = 0.0
+    error_status: int = 503
+
+    def wait(self):
+        delay = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+    def should_fail(self) -> bool:
+        return self.error_rate > 0 and random.random() < self.error_rate
+
+
+# 実際のAPIに近いレイテンシ（ミリ秒）
+DEFAULT_PROFILES = {
+    "supabase": Profile(latency_ms=40, jitter_ms=20),
+    "openai": Profile(latency_ms=1500, jitter_ms=700),
+    "stability": Profile(latency_ms=8000, jitter_ms=3000),
+    "jancode": Profile(latency_ms=150, jitter_ms=80),
+}
+
+
+def make_png(size: int = 1024) -> bytes:
+    img = Image.new("RGB", (size, size), (random.randint(0, 255), 120, 200))
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def fake_jwt(payload: dict) -> str:
+    def b64(obj):
+        return base64.urlsafe_b64encode(json.dumps(obj).encode()).decode().rstrip("=")
+    return f"{b64({'alg': 'HS256', 'typ': 'JWT'})}.{b64(payload)}.mock"
+
+
+class MockState:
+    """Supabaseのテーブルとストレージをメモリ上に持つ"""
+
+    def __init__(self, png_size: int = 1024):
+        self.lock = threading.Lock()
+        self.tables = {"users": [], "user_operations": []}
+        self.objects = {}
+        self.users = {}
+        self.png = make_png(png_size)
+        self.requests = {name: 0 for name in SERVICES}
+        self.errors = {name: 0 for name in SERVICES}
+        self._next_id = 1
+
+    def auth_user(self, email: str, full_name: str = "") -> dict:
+        """メールアドレスからユーザーを作る（初回はプロフィール行も作る）"""
+        with self.lock:
+            user = self.users.get(email)
+            if user is None:
+                user_id = str(uuid.uuid5(uuid.NAMESPACE_URL, email))
+                user = {
+                    "id": user_id,
+                    "aud": "authenticated",
+                    "role": "authenticated",
+                    "email": email,
+                    "app_metadata": {"provider": "email"},
+                    "user_metadata": {"full_name": full_name or email.split("@")[0]},
+                    "created_at": "2025-01-01T00:00:00Z",
+                }
+                self.users[email] = user
+                self.tables["users"].append({
+                    "user_id": user_id, "mail_address": email,
+                    "user_name": user["user_metadata"]["full_name"],
+                })
+            return user
+
+    def insert(self, table: str, rows: list) -> list:
+        with self.lock:
+            stored = []
+            for row in rows:
+                row = dict(row)
+                row.setdefault("id", self._next_id)
+                row.setdefault("created_at", time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime()) + f".{self._next_id:06d}Z")
+                self._next_id += 1
+                self.tables.setdefault(table, []).append(row)
+                stored.append(row)
+            return stored
+
+
+def _json_path_value(row: dict, column: str):
+    """character_parameter->>region のような JSON 参照を解決する"""
+    if "->" not in column:
+        return row.get(column)
+    parts = column.replace("->>", "->").split("->")
+    value = row.get(parts[0])
+    for part in parts[1:]:
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+
+def _compare(value, op: str, arg: str) -> bool:
+    if op == "is":
+        return value is None if arg == "null" else str(value).lower() == arg
+    if op == "in":
+        return str(value) in arg.strip("()").split(",")
+    if value is None:
+        return False
+    if op in ("like", "ilike"):
+        needle = arg.replace("*", "").replace("%", "")
+        return needle.lower() in str(value).lower() if op == "ilike" else needle in str(value)
+    try:
+        left, right = float(value), float(arg)
+    except (TypeError, ValueError):
+        left, right = str(value), arg
+    return {
+        "eq": left == right, "neq": left != right, "gt": left > right,
+        "gte": left >= right, "lt": left < right, "lte": left <= right,
+    }.get(op, False)
+
+
+def filter_rows(rows: list, query: dict) -> list:
+    """PostgREST のクエリ（eq/gte/ilike/order/limit/offset）を最低限だけ解釈する"""
+    result = list(rows)
+    for key, values in query.items():
+        if key in ("select", "order", "limit", "offset", "on_conflict", "columns"):
+            continue
+        for raw in values:
+            negate = raw.startswith("not.")
+            op, _, arg = raw[4:].partition(".") if negate else raw.partition(".")
+            result = [r for r in result if _compare(_json_path_value(r, key), op, unquote(arg)) != negate]
+
+    for order in reversed((query.get("order") or [""])[0].split(",")):
+        if not order:
+            continue
+        parts = order.split(".")
+        desc = "desc" in parts[1:]
+        result.sort(key=lambda r: (_json_path_value(r, parts[0]) is None, _json_path_value(r, parts[0]) or 0), reverse=desc)
+
+    offset = int((query.get("offset") or ["0"])[0])
+    limit = query.get("limit")
+    return result[offset: offset + int(limit[0])] if limit else result[offset:]
+
+
+def make_handler(service: str, profile: Profile, state: MockState):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _body(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            return self.rfile.read(length) if length else b""
+
+        def _send(self, status: int, payload=None, content_type="application/json", headers=None):
+            if isinstance(payload, (dict, list)):
+                body = json.dumps(payload).encode()
+            else:
+                body = payload or b""
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _handle(self, method: str):
+            body = self._body()
+            with state.lock:
+                state.requests[service] += 1
+            profile.wait()
+            if profile.should_fail():
+                with state.lock:
+                    state.errors[service] += 1
+                self._send(profile.error_status, {"error": "mock failure", "message": "mock failure"})
+                return
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            try:
+                payload = json.loads(body) if body and "json" in (self.headers.get("Content-Type") or "") else body
+            except ValueError:
+                payload = body
+            getattr(self, f"_{service}")(method, url.path, query, payload)
+
+        def do_GET(self):
+            self._handle("GET")
+
+        def do_POST(self):
+            self._handle("POST")
+
+        def do_PATCH(self):
+            self._handle("PATCH")
+
+        def do_PUT(self):
+            self._handle("PUT")
+
+        def do_DELETE(self):
+            self._handle("DELETE")
+
+        # --- Supabase ---
+        def _supabase(self, method, path, query, payload):
+            if path.startswith("/auth/v1/"):
+                return self._supabase_auth(method, path[len("/auth/v1/"):], payload)
+            if path.startswith("/rest/v1/"):
+                return self._supabase_rest(method, path[len("/rest/v1/"):], query, payload)
+            if path.startswith("/storage/v1/"):
+                return self._supabase_storage(method, path[len("/storage/v1/"):], payload)
+            self._send(404, {"message": "not found"})
+
+        def _session(self, user: dict) -> dict:
+            now = int(time.time())
+            token = fake_jwt({"sub": user["id"], "email": user["email"], "role": "authenticated", "exp": now + 3600})
+            return {
+                "access_token": token, "token_type": "bearer", "expires_in": 3600,
+                "expires_at": now + 3600, "refresh_token": uuid.uuid4().hex, "user": user,
+            }
+
+        def _supabase_auth(self, method, path, payload):
+            payload = payload if isinstance(payload, dict) else {}
+            if path == "token":
+                return self._send(200, self._session(state.auth_user(payload.get("email", "player@example.com"))))
+            if path == "signup":
+                meta = (payload.get("data") or {})
+                user = state.auth_user(payload.get("email", "player@example.com"), meta.get("full_name", ""))
+                return self._send(200, {**self._session(user), **user})
+            if path == "logout":
+                return self._send(204)
+            if path == "user":
+                auth = self.headers.get("Authorization", "")
+                for user in state.users.values():
+                    if user["id"] in base64.urlsafe_b64decode(auth.split(".")[1] + "==").decode(errors="ignore"):
+                        return self._send(200, user)
+                return self._send(401, {"message": "invalid token"})
+            self._send(404, {"message": "not found"})
+
+        def _supabase_rest(self, method, table, query, payload):
+            with state.lock:
+                rows = list(state.tables.get(table, []))
+            if method == "GET":
+                matched = filter_rows(rows, query)
+                total = len(filter_rows(rows, {k: v for k, v in query.items() if k not in ("limit", "offset")}))
+                return self._send(200, matched, headers={"Content-Range": f"0-{max(len(matched) - 1, 0)}/{total}"})
+            if method == "POST":
+                items = payload if isinstance(payload, list) else [payload]
+                prefer = self.headers.get("Prefer", "")
+                if "resolution=merge-duplicates" in prefer:
+                    with state.lock:
+                        by_id = {r.get("id"): r for r in state.tables.get(table, [])}
+                        new_items = []
+                        for item in items:
+                            if item.get("id") in by_id:
+                                by_id[item["id"]].update(item)
+                            else:
+                                new_items.append(item)
+                    stored = state.insert(table, new_items) + [by_id[i["id"]] for i in items if i.get("id") in by_id]
+                else:
+                    stored = state.insert(table, items)
+                return self._send(201, stored)
+            if method == "PATCH":
+                with state.lock:
+                    matched = filter_rows(state.tables.get(table, []), query)
+                    for row in matched:
+                        row.update(payload or {})
+                return self._send(200, matched)
+            if method == "DELETE":
+                with state.lock:
+                    matched = filter_rows(state.tables.get(table, []), query)
+                    state.tables[table] = [r for r in state.tables.get(table, []) if r not in matched]
+                return self._send(200, matched)
+            self._send(405, {"message": "method not allowed"})
+
+        def _supabase_storage(self, method, path, payload):
+            if method == "GET" and path.startswith(("object/public/", "render/image/public/")):
+                key = path.split("public/", 1)[1]
+                data = state.objects.get(key, state.png)
+                return self._send(200, data, content_type="image/png")
+            if method in ("POST", "PUT") and path.startswith("object/"):
+                key = path[len("object/"):]
+                state.objects[key] = payload if isinstance(payload, bytes) else b""
+                return self._send(200, {"Key": key, "Id": uuid.uuid4().hex})
+            if method == "HEAD" or path.startswith("object/info/"):
+                return self._send(200, {})
+            self._send(404, {"message": "not found"})
+
+        # --- OpenAI ---
+        def _openai(self, method, path, query, payload):
+            payload = payload if isinstance(payload, dict) else {}
+            if path.endswith("/chat/completions"):
+                content = json.dumps({
+                    "prompt": "chibi anime hero, retro card battle game illustration, bold outline, colorful aura",
+                    "character_name": random.choice(["モックマン", "テストン", "バーコード丸"]),
+                }, ensure_ascii=False)
+                if payload.get("stream"):
+                    return self._openai_stream(payload, content)
+                return self._send(200, {
+                    "id": f"chatcmpl-{uuid.uuid4().hex}", "object": "chat.completion", "created": int(time.time()),
+                    "model": payload.get("model", "gpt-3.5-turbo"),
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": 300, "completion_tokens": 60, "total_tokens": 360},
+                })
+            if path.endswith("/images/generations"):
+                return self._send(200, {
+                    "created": int(time.time()),
+                    "data": [{"b64_json": base64.b64encode(state.png).decode()}],
+                })
+            self._send(404, {"error": {"message": "not found"}})
+
+        def _openai_stream(self, payload, content):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            chunk_id = f"chatcmpl-{uuid.uuid4().hex}"
+            for i in range(0, len(content), 8):
+                chunk = {
+                    "id": chunk_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                    "model": payload.get("model", "gpt-3.5-turbo"),
+                    "choices": [{"index": 0, "delta": {"content": content[i:i + 8]}, "finish_reason": None}],
+                }
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.flush()
+                time.sleep(0.02)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+            self.close_connection = True
+
+        # --- Stability AI ---
+        def _stability(self, method, path, query, payload):
+            if path.endswith("/text-to-image"):
+                return self._send(200, {"artifacts": [{
+                    "base64": base64.b64encode(state.png).decode(), "seed": random.randint(0, 2**31), "finishReason": "SUCCESS",
+                }]})
+            self._send(404, {"message": "not found"})
+
+        # --- jancodelookup ---
+        def _jancode(self, method, path, query, payload):
+            code = (query.get("query") or [""])[0]
+            products = [] if not code else [{
+                "codeNumber": code,
+                "codeType": "JAN",
+                "itemName": f"モック商品{code[-4:]}",
+                "makerName": "モック製菓",
+                "itemImageUrl": "https://example.com/item.png",
+            }]
+            self._send(200, {"info": {"count": len(products)}, "product": products})
+
+    return Handler
+
+
+class MockUpstreams:
+    """4つのモックサーバーをまとめて起動・停止する"""
+
+    def __init__(self, profiles: dict = None, host: str = "127.0.0.1", png_size: int = 1024):
+        self.profiles = {**DEFAULT_PROFILES, **(profiles or {})}
+        self.host = host
+        self.state = MockState(png_size)
+        self.servers = {}
+        self._threads = []
+
+    def start(self):
+        for service in SERVICES:
+            server = ThreadingHTTPServer((self.host, 0), make_handler(service, self.profiles[service], self.state))
+            server.daemon_threads = True
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            self.servers[service] = server
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        for server in self.servers.values():
+            server.shutdown()
+            server.server_close()
+
+    def url(self, service: str) -> str:
+        host, port = self.servers[service].server_address[:2]
+        return f"http://{host}:{port}"
+
+    def env(self) -> dict:
+        """アプリをモックに向けるための環境変数"""
+        return {
+            "SUPABASE_URL": self.url("supabase"),
+            "SUPABASE_KEY": fake_jwt({"role": "anon"}),
+            "OPENAI_API_KEY": "sk-mock",
+            "OPENAI_BASE_URL": self.url("openai") + "/v1",
+            "API_HOST": self.url("stability"),
+            "STABILITY_API_KEY": "sk-mock",
+            "JANCODE_APP_ID": "mock",
+            "JANCODE_API_BASE": self.url("jancode") + "/",
+        }
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def parse_profile_args(latency: list, error_rate: list) -> dict:
+    """--latency openai=800:200 / --error-rate stability=0.05 をProfileにする"""
+    profiles = {name: Profile(**vars(profile)) for name, profile in DEFAULT_PROFILES.items()}
+    for item in latency or []:
+        name, _, value = item.partition("=")
+        mean, _, jitter = value.partition(":")
+        profiles[name].latency_ms = float(mean)
+        profiles[name].jitter_ms = float(jitter or 0)
+    for item in error_rate or []:
+        name, _, value = item.partition("=")
+        profiles[name].error_rate = float(value)
+    return profiles
+
+
+def add_profile_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency", action="append", metavar="SERVICE=MS[:JITTER]",
+                        help=f"遅延の設定（SERVICE: {', '.join(SERVICES)}）")
+    parser.add_argument("--error-rate", action="append", metavar="SERVICE=RATE",
+                        help="エラーを返す割合（0〜1）")
+    parser.add_argument("--png-size", type=int, default=1024, help="返す画像の一辺のピクセル数")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="外部APIのモックサーバーを起動する")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    mocks = MockUpstreams(parse_profile_args(args.latency, args.error_rate), png_size=args.png_size).start()
+    print("モックサーバーを起動しました。以下の環境変数でアプリを起動してください:")
+    for key, value in mocks.env().items():
+        print(f"export {key}={value}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        mocks.stop()
+
+
+if __name__ == "__main__":
+    main()
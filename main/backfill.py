@@ -0,0 +1,238 @@
+#user_operations のバックフィル（既存行の一括書き換え）
+# テーブル全体をメモリに載せず、id のキーセットページングで少しずつ読み、
+# スレッドプールで並列に処理して、まとめて upsert で書き戻す。
+# チャンクごとにチェックポイントを保存するので、途中で止まっても続きから再開できる。
+#
+# 例: python main/backfill.py combat_power --chunk-size 500 --workers 8
+#     python main/backfill.py thumbnail --resume
+#     python main/backfill.py promote --dry-run
+#     python main/backfill.py thumbnail --retry-failed
+#
+# タスク:
+#   combat_power  character_parameter.combat_power を JAN から計算し直す
+#   promote       character_parameter の region / power を列に昇格する（sql/ のマイグレーションが必要。
+#                 列はまだアプリから使っていない、切り替えの準備）
+#   thumbnail     画像を縮小してサムネイルを保存し、character_parameter.thumbnail_url に入れる
+#   image_hash    画像の dHash を計算して character_parameter.image_hash に入れる（重複検出用）
+
+import argparse
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from PIL import Image
+
+from cli_env import create_supabase_from_env
+from image_hash import dhash, hash_to_hex
+from images import upload_image_bytes
+from jan import combat_power_from_jan
+from keyset import TABLE, iter_row_chunks
+
+THUMBNAIL_SIZE = 256
+
+
+# === タスク（1行を受け取り、書き換える列の dict を返す。変更なしなら None） ===
+
+def task_combat_power(row: dict, supabase):
+    params = dict(row.get("character_parameter") or {})
+    power = combat_power_from_jan(row.get("code_number", ""))
+    if params.get("combat_power") == power:
+        return None
+    params["combat_power"] = power
+    return {"character_parameter": params}
+
+
+def task_promote(row: dict, supabase):
+    params = row.get("character_parameter") or {}
+    updates = {}
+    if params.get("region") and row.get("region") != params["region"]:
+        updates["region"] = params["region"]
+    if params.get("power") is not None and row.get("power") != params["power"]:
+        updates["power"] = params["power"]
+    return updates or None
+
+
+def task_thumbnail(row: dict, supabase):
+    params = dict(row.get("character_parameter") or {})
+    url = row.get("character_img_url")
+    if not url or params.get("thumbnail_url"):
+        return None
+
+    response = requests.get(url, timeout=30)
+    response.raise_for_status()
+    image = Image.open(io.BytesIO(response.content)).convert("RGB")
+    image.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+    buffer = io.BytesIO()
+    image.save(buffer, format="WEBP", quality=80)
+
+    params["thumbnail_url"] = upload_image_bytes(supabase, f"thumbnails/{row['id']}", buffer.getvalue(), "image/webp")
+    return {"character_parameter": params}
+
+
+def task_image_hash(row: dict, supabase):
+    params = dict(row.get("character_parameter") or {})
+    url = row.get("character_img_url")
+    if not url or params.get("image_hash"):
+        return None
+
+    response = requests.get(url, timeout=30)
+    response.raise_for_status()
+    params["image_hash"] = hash_to_hex(dhash(response.content))
+    return {"character_parameter": params}
+
+
+TASKS = {
+    "combat_power": task_combat_power,
+    "promote": task_promote,
+    "thumbnail": task_thumbnail,
+    "image_hash": task_image_hash,
+}
+
+
+# === チェックポイント ===
+
+def new_checkpoint(task: str) -> dict:
+    return {"task": task, "last_id": None, "processed": 0, "updated": 0, "failed": 0, "failed_ids": []}
+
+
+def load_checkpoint(path: str, task: str) -> dict:
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            checkpoint = json.load(f)
+        if checkpoint.get("task") == task:
+            return checkpoint
+    return new_checkpoint(task)
+
+
+def save_checkpoint(path: str, checkpoint: dict):
+    """書きかけのファイルが残らないよう、一時ファイルに書いてから置き換える"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+# === 本体 ===
+
+def process_chunk(rows: list, task, supabase, pool: ThreadPoolExecutor):
+    """1チャンクを並列に処理し、(書き戻す行, 失敗した id) を返す"""
+    def run(row):
+        try:
+            return row, task(row, supabase), None
+        except Exception as e:
+            return row, None, e
+
+    upserts, failed = [], []
+    for row, updates, error in pool.map(run, rows):
+        if error is not None:
+            print(f"  id={row.get('id')} の処理に失敗: {error}", file=sys.stderr)
+            failed.append(row.get("id"))
+        elif updates:
+            upserts.append({**row, **updates})
+    return upserts, failed
+
+
+def run_backfill(task_name: str, chunk_size: int = 500, workers: int = 8, checkpoint_path: str = None,
+                 resume: bool = False, dry_run: bool = False, limit: int = None):
+    supabase = create_supabase_from_env()
+    task = TASKS[task_name]
+    checkpoint_path = checkpoint_path or f"backfill_{task_name}.checkpoint.json"
+    checkpoint = load_checkpoint(checkpoint_path, task_name) if resume else new_checkpoint(task_name)
+    if resume and checkpoint["last_id"] is not None:
+        print(f"id > {checkpoint['last_id']} から再開します（処理済み {checkpoint['processed']} 行）")
+
+    started = time.perf_counter()
+    processed_this_run = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for rows in iter_row_chunks(supabase, chunk_size, checkpoint["last_id"]):
+            if limit is not None:
+                rows = rows[: max(limit - processed_this_run, 0)]
+                if not rows:
+                    break
+
+            chunk_started = time.perf_counter()
+            upserts, failed = process_chunk(rows, task, supabase, pool)
+            if upserts and not dry_run:
+                supabase.table(TABLE).upsert(upserts, on_conflict="id").execute()
+
+            processed_this_run += len(rows)
+            checkpoint["last_id"] = rows[-1]["id"]
+            checkpoint["processed"] += len(rows)
+            checkpoint["updated"] += len(upserts)
+            checkpoint["failed"] += len(failed)
+            checkpoint["failed_ids"] = checkpoint["failed_ids"] + failed
+            if not dry_run:
+                save_checkpoint(checkpoint_path, checkpoint)
+
+            chunk_elapsed = time.perf_counter() - chunk_started
+            total_elapsed = time.perf_counter() - started
+            print(f"id <= {checkpoint['last_id']}: {len(rows)} 行（更新 {len(upserts)} / 失敗 {len(failed)}）"
+                  f" {len(rows) / max(chunk_elapsed, 1e-6):.1f} 行/秒"
+                  f"（平均 {processed_this_run / max(total_elapsed, 1e-6):.1f} 行/秒）")
+
+    elapsed = time.perf_counter() - started
+    print(f"完了: {processed_this_run} 行を {elapsed:.1f} 秒で処理"
+          f"（累計 処理 {checkpoint['processed']} / 更新 {checkpoint['updated']} / 失敗 {checkpoint['failed']}）"
+          + ("  ※dry-run のため書き戻していません" if dry_run else ""))
+    return checkpoint
+
+
+def retry_failed(task_name: str, chunk_size: int = 500, workers: int = 8, checkpoint_path: str = None,
+                 dry_run: bool = False):
+    """チェックポイントに残っている失敗した行だけをやり直す。また失敗した行は残す。"""
+    supabase = create_supabase_from_env()
+    task = TASKS[task_name]
+    checkpoint_path = checkpoint_path or f"backfill_{task_name}.checkpoint.json"
+    checkpoint = load_checkpoint(checkpoint_path, task_name)
+    pending = list(dict.fromkeys(checkpoint["failed_ids"]))
+    if not pending:
+        print("やり直す行はありません")
+        return checkpoint
+    print(f"失敗した {len(pending)} 行をやり直します")
+
+    still_failed, updated = [], 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for start in range(0, len(pending), chunk_size):
+            ids = pending[start:start + chunk_size]
+            rows = supabase.table(TABLE).select("*").in_("id", ids).execute().data or []
+            upserts, failed = process_chunk(rows, task, supabase, pool)
+            if upserts and not dry_run:
+                supabase.table(TABLE).upsert(upserts, on_conflict="id").execute()
+            updated += len(upserts)
+            still_failed += failed
+
+    checkpoint["updated"] += updated
+    checkpoint["failed"] = len(still_failed)
+    checkpoint["failed_ids"] = still_failed
+    if not dry_run:
+        save_checkpoint(checkpoint_path, checkpoint)
+    print(f"完了: {len(pending)} 行をやり直し（更新 {updated} / まだ失敗 {len(still_failed)}）"
+          + ("  ※dry-run のため書き戻していません" if dry_run else ""))
+    return checkpoint
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="user_operations のバックフィル")
+    parser.add_argument("task", choices=sorted(TASKS))
+    parser.add_argument("--chunk-size", type=int, default=500, help="1回に読む行数")
+    parser.add_argument("--workers", type=int, default=8, help="並列に処理するスレッド数")
+    parser.add_argument("--checkpoint", help="チェックポイントファイルのパス")
+    parser.add_argument("--resume", action="store_true", help="チェックポイントの続きから再開する")
+    parser.add_argument("--retry-failed", action="store_true", help="チェックポイントに残っている失敗した行だけをやり直す")
+    parser.add_argument("--dry-run", action="store_true", help="書き戻さずに件数だけ確認する")
+    parser.add_argument("--limit", type=int, help="この実行で処理する最大行数")
+    args = parser.parse_args(argv)
+
+    if args.retry_failed:
+        retry_failed(args.task, args.chunk_size, args.workers, args.checkpoint, args.dry_run)
+        return 0
+    run_backfill(args.task, args.chunk_size, args.workers, args.checkpoint, args.resume, args.dry_run, args.limit)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
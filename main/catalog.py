@@ -0,0 +1,187 @@
+#商品カタログのローカルスナップショット
+# イベントなどで事前にわかっている商品をSQLiteに取り込み、
+# jancodelookup API を呼ぶ前にローカルで引けるようにする。
+#
+# 取り込み:  python main/catalog.py import products.csv [--db catalog.sqlite3]
+# 検索確認:  python main/catalog.py lookup 4901234 [--hits 10]
+#
+# CSV/JSON の列: codeNumber(またはJAN), itemName, makerName, itemImageUrl
+
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from jan import normalize_many
+
+DEFAULT_CATALOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "catalog.sqlite3")
+CATALOG_PATH = os.getenv("JAN_CATALOG_PATH", DEFAULT_CATALOG_PATH)
+
+# APIの返却形式に合わせたカラム名（事前生成のプール・画面に残す商品情報もこの形）
+PRODUCT_FIELDS = ("codeNumber", "itemName", "makerName", "itemImageUrl")
+
+# 取り込み元の列名の揺れを吸収する
+_ALIASES = {
+    "jan": "codeNumber", "jancode": "codeNumber", "jan_code": "codeNumber", "code": "codeNumber",
+    "codenumber": "codeNumber", "code_number": "codeNumber",
+    "itemname": "itemName", "item_name": "itemName",
+    "makername": "makerName", "maker_name": "makerName",
+    "itemimageurl": "itemImageUrl", "item_image_url": "itemImageUrl",
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    code TEXT PRIMARY KEY,
+    item_name TEXT NOT NULL DEFAULT '',
+    maker_name TEXT NOT NULL DEFAULT '',
+    item_image_url TEXT NOT NULL DEFAULT ''
+) WITHOUT ROWID
+"""
+
+
+def connect(path: str = None) -> sqlite3.Connection:
+    conn = sqlite3.connect(path or CATALOG_PATH, check_same_thread=False)
+    conn.execute(_SCHEMA)
+    return conn
+
+
+def _normalize_row(row: dict):
+    """列名を揃えて (元のコード, itemName, makerName, itemImageUrl) のタプルにする"""
+    fixed = {}
+    for key, value in row.items():
+        if key is None:
+            continue
+        name = _ALIASES.get(key.strip().lower(), key.strip())
+        fixed[name] = "" if value is None else str(value).strip()
+    return (fixed.get("codeNumber", ""), fixed.get("itemName", ""), fixed.get("makerName", ""), fixed.get("itemImageUrl", ""))
+
+
+def iter_source_rows(path: str):
+    """CSV / JSON / JSON Lines を1行ずつ返す（ファイル全体をリストにしない）"""
+    lower = path.lower()
+    if lower.endswith(".csv"):
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            yield from csv.DictReader(f)
+    elif lower.endswith((".jsonl", ".ndjson")):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        # APIのレスポンスをそのまま保存したもの ({"product": [...]}) にも対応
+        if isinstance(data, dict):
+            data = data.get("product") or []
+        yield from data
+
+
+def import_catalog(source_path: str, db_path: str = None, batch_size: int = 5000, invalid=None) -> int:
+    """
+    カタログファイルをSQLiteに一括取り込み。取り込んだ件数を返す。
+    コードはアプリの検索と同じく normalize_jan で揃えて保存する（UPC-A は先頭0の13桁）。
+    桁数・チェックディジットが不正な行は取り込まず、invalid（リスト）に元のコードを入れる。
+    """
+    conn = connect(db_path)
+    count = 0
+    batch = []
+    rows = (_normalize_row(raw) for raw in iter_source_rows(source_path))
+    try:
+        with conn:
+            for row, code in normalize_many(rows, key=lambda row: row[0]):
+                if code is None:
+                    if invalid is not None:
+                        invalid.append(row[0])
+                    continue
+                batch.append((code,) + row[1:])
+                if len(batch) >= batch_size:
+                    conn.executemany("INSERT OR REPLACE INTO products VALUES (?, ?, ?, ?)", batch)
+                    count += len(batch)
+                    batch.clear()
+            if batch:
+                conn.executemany("INSERT OR REPLACE INTO products VALUES (?, ?, ?, ?)", batch)
+                count += len(batch)
+    finally:
+        conn.close()
+    return count
+
+
+class Catalog:
+    """
+    ローカルカタログの読み取り用。Streamlitの全セッションから使うのでロックで保護する。
+    ファイルがなければ何もヒットしない（APIにフォールバック）。
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or CATALOG_PATH
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def available(self) -> bool:
+        return os.path.exists(self.path)
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = connect(self.path)
+        return self._conn
+
+    def search(self, prefix: str, hits: int = 10) -> list:
+        """
+        APIの type=code と同じ前方一致検索。
+        主キーの範囲検索 (prefix <= code < prefix + ':') なのでインデックスだけで引ける。
+        """
+        prefix = "".join(ch for ch in str(prefix) if ch.isdigit())
+        if not prefix or not self.available():
+            return []
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT code, item_name, maker_name, item_image_url FROM products "
+                "WHERE code >= ? AND code < ? ORDER BY code LIMIT ?",
+                (prefix, prefix + ":", hits),
+            ).fetchall()
+        return [dict(zip(PRODUCT_FIELDS, row)) for row in rows]
+
+    def get(self, jan_code: str):
+        products = self.search(jan_code, hits=1)
+        return products[0] if products else None
+
+
+# プロセス内で共有するカタログ
+catalog = Catalog()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="商品カタログのローカルスナップショット")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_import = sub.add_parser("import", help="CSV/JSONを取り込む")
+    p_import.add_argument("source")
+    p_import.add_argument("--db", default=None)
+
+    p_lookup = sub.add_parser("lookup", help="前方一致で検索する")
+    p_lookup.add_argument("prefix")
+    p_lookup.add_argument("--db", default=None)
+    p_lookup.add_argument("--hits", type=int, default=10)
+
+    args = parser.parse_args(argv)
+    if args.command == "import":
+        started = time.perf_counter()
+        invalid = []
+        count = import_catalog(args.source, args.db, invalid=invalid)
+        elapsed = time.perf_counter() - started
+        print(f"{count} 件を取り込みました ({elapsed:.2f}s) -> {args.db or CATALOG_PATH}")
+        if invalid:
+            examples = ", ".join(invalid[:5])
+            print(f"JANとして正しくない {len(invalid)} 件は取り込みませんでした（例: {examples}）")
+    else:
+        for product in Catalog(args.db).search(args.prefix, args.hits):
+            print(json.dumps(product, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
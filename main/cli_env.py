@@ -0,0 +1,43 @@
+#コマンドラインツール（バックフィル・事前生成など）用の設定読み込み
+# Streamlit を起動しないので st.secrets は使わず、環境変数 / .env から読む。
+
+import os
+import sys
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except Exception:
+    pass
+
+
+def require_env(name: str) -> str:
+    """環境変数を取得。見つからなければメッセージを出して終了する。"""
+    value = os.getenv(name)
+    if not value:
+        sys.exit(f"{name} が見つかりません。環境変数または .env に設定してください。")
+    return value
+
+
+def create_supabase_from_env():
+    """
+    ツール用のSupabaseクライアント。全ユーザーの行を扱うので、
+    SUPABASE_SERVICE_ROLE_KEY があればそちらを使う（RLSを通らない）。
+    """
+    from supabase import create_client
+    key = os.getenv("SUPABASE_SERVICE_ROLE_KEY") or require_env("SUPABASE_KEY")
+    return create_client(require_env("SUPABASE_URL"), key)
+
+
+def create_services_from_env():
+    """ツール用の外部API（OpenAI・Stability・jancodelookup）。画面と同じ環境変数を使う。"""
+    from services import StabilityConfig, UpstreamServices
+    return UpstreamServices(
+        openai_api_key=require_env("OPENAI_API_KEY"),
+        stability=StabilityConfig(
+            api_host=os.getenv("API_HOST", "https://api.stability.ai"),
+            api_key=require_env("STABILITY_API_KEY"),
+        ),
+        jancode_app_id=require_env("JANCODE_APP_ID"),
+        jancode_base=os.getenv("JANCODE_API_BASE", "https://api.jancodelookup.com/"),
+    )
@@ -0,0 +1,234 @@
+#図鑑（コレクション）のエクスポート・インポート
+# ZIP の中身:
+#   characters.jsonl   user_operations の行（1行1キャラ）
+#   images/<id>.png    キャラクター画像
+# 行は id のキーセットページングで少しずつ読み、画像は少数ずつ並列にダウンロードして
+# そのままZIPに書き込む。ZIPはディスク上の一時ファイルに作るので、コレクション全体をメモリに載せない。
+# ZIPは EXPORT_PART_BYTES ごとに分ける（ストレージの1ファイルの上限・アップロードの上限に収めるため）。
+# 各パートは画像とその行を持つ完全なZIPなので、1つずつ取り込める。
+# できたZIPはストレージ（非公開バケット）にファイルのまま送り、署名付きURLでダウンロードしてもらう。
+
+import io
+import json
+import os
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from images import upload_image_bytes
+from keyset import iter_row_chunks
+
+TABLE = "user_operations"
+ROWS_ENTRY = "characters.jsonl"
+IMAGES_DIR = "images/"
+# エクスポートしたZIPの置き場所（sql/collection_exports_bucket.sql）
+EXPORT_BUCKET = os.getenv("EXPORT_BUCKET", "collection-exports")
+# ダウンロード用URLの有効期限（秒）
+EXPORT_URL_EXPIRES = 3600
+# 1つのZIP（パート）の大きさの上限。Supabaseストレージの既定の上限（50MB）より少し小さくする
+EXPORT_PART_BYTES = int(os.getenv("EXPORT_PART_MB", "45")) * 1024 * 1024
+# ZIPの1エントリあたりのヘッダーなどの大きさ（概算）
+_ENTRY_OVERHEAD = 200
+# インポート時にDBへ書き戻さない列
+_SERVER_COLUMNS = ("id", "user_id", "created_at", "character_img_url")
+
+
+def _download(url: str) -> bytes:
+    response = requests.get(url, timeout=30)
+    response.raise_for_status()
+    return response.content
+
+
+def _windows(items: list, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class _PartWriter:
+    """
+    ZIPを part_bytes ごとのパートに分けて一時ファイルに書く。
+    各パートは画像と、その画像の行（characters.jsonl）を持つ。
+    """
+
+    def __init__(self, part_bytes: int):
+        self.part_bytes = part_bytes
+        self.paths = []
+        self._zf = None
+        self._rows = None
+        self._size = 0
+
+    def _open(self):
+        fd, path = tempfile.mkstemp(prefix="collection_", suffix=".zip")
+        os.close(fd)
+        self.paths.append(path)
+        self._zf = zipfile.ZipFile(path, "w", compression=zipfile.ZIP_STORED)
+        self._rows = tempfile.TemporaryFile("w+", encoding="utf-8")
+        self._size = 0
+
+    def _close_part(self):
+        if self._zf is None:
+            return
+        self._rows.seek(0)
+        with self._zf.open(ROWS_ENTRY, "w", force_zip64=True) as dst:
+            for line in self._rows:
+                dst.write(line.encode("utf-8"))
+        self._rows.close()
+        self._zf.close()
+        self._zf = None
+
+    def add(self, record: dict, name: str = None, data: bytes = None):
+        """行（と画像）を書く。今のパートに収まらなければ次のパートに書く。"""
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        size = len(line.encode("utf-8"))
+        if data is not None:
+            size += len(data) + len(name) + _ENTRY_OVERHEAD
+        if self._zf is None or (self._size and self._size + size > self.part_bytes):
+            self._close_part()
+            self._open()
+        if data is not None:
+            self._zf.writestr(name, data)
+        self._rows.write(line)
+        self._size += size
+
+    def close(self) -> list:
+        if self._zf is None and not self.paths:
+            self._open()  # 0件でも空のZIPを1つ作る
+        self._close_part()
+        return self.paths
+
+    def discard(self):
+        """書きかけのパートも含めて消す"""
+        if self._zf is not None:
+            self._rows.close()
+            self._zf.close()
+            self._zf = None
+        remove_files(self.paths)
+
+
+def remove_files(paths: list):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def export_collection(supabase, user_id: str, workers: int = 8, chunk_size: int = 200, on_progress=None,
+                      part_bytes: int = EXPORT_PART_BYTES) -> list:
+    """
+    ユーザーのコレクションをZIPにしてディスク上の一時ファイルに書き出し、パートのパスのリストを返す。
+    メモリに載るのは画像 workers 枚分まで。
+    """
+    writer = _PartWriter(part_bytes)
+    count = 0
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for rows in iter_row_chunks(supabase, chunk_size, user_id=user_id):
+                # 画像は workers 枚ずつ並列にダウンロードし、届いた順にZIPへ書く
+                for window in _windows(rows, workers):
+                    urls = [row.get("character_img_url") for row in window]
+                    futures = [pool.submit(_download, url) if url else None for url in urls]
+                    for row, future in zip(window, futures):
+                        record = dict(row)
+                        name, data = None, None
+                        if future is not None:
+                            try:
+                                data = future.result()
+                                name = f"{IMAGES_DIR}{row['id']}.png"
+                                record["image_file"] = name
+                            except Exception as e:
+                                record["image_error"] = str(e)
+                        writer.add(record, name, data)
+                        count += 1
+                if on_progress:
+                    on_progress(count)
+        return writer.close()
+    except BaseException:
+        # 途中で失敗したら書きかけのZIPを残さない
+        writer.discard()
+        raise
+
+
+def publish_export(supabase, user_id: str, zip_paths: list, expires_in: int = EXPORT_URL_EXPIRES) -> list:
+    """
+    ZIP（パート）をストレージに上げ、ダウンロード用の署名付きURLのリストを返す。ローカルの一時ファイルは消す。
+    ファイルはパスのまま渡すので、アップロード中もZIP全体はメモリに載らない。
+    置き場所はユーザーごとに1つのフォルダで、前回のエクスポートは消してから上げる（古いものは溜まらない）。
+    """
+    bucket = supabase.storage.from_(EXPORT_BUCKET)
+    try:
+        old = [f"{user_id}/{item['name']}" for item in bucket.list(user_id) or [] if item.get("name")]
+        if old:
+            bucket.remove(old)
+        stamp = time.strftime('%Y%m%d_%H%M%S')
+        urls = []
+        for number, zip_path in enumerate(zip_paths, start=1):
+            path = f"{user_id}/collection_{number:03d}.zip"
+            bucket.upload(path, zip_path, {"content-type": "application/zip", "upsert": "true"})
+            os.remove(zip_path)
+            signed = bucket.create_signed_url(
+                path, expires_in, {"download": export_filename(stamp, number, len(zip_paths))}
+            )
+            urls.append(signed.get("signedURL") or signed.get("signedUrl"))
+        return urls
+    finally:
+        remove_files(zip_paths)
+
+
+def _upload_image(supabase, user_id: str, image_bytes: bytes, record: dict) -> str:
+    code = "".join(ch for ch in str(record.get("code_number", "")) if ch.isdigit()) or "unknown"
+    return upload_image_bytes(supabase, f"characters/{user_id}_{code}", image_bytes)
+
+
+def import_collection(supabase, user_id: str, zip_source, batch_size: int = 50, workers: int = 8,
+                      on_progress=None) -> int:
+    """
+    export_collection で作ったZIPを取り込む。画像は batch_size 件ずつ並列にアップロードし、
+    行はバッチごとにまとめて insert する。取り込んだ件数を返す。
+    """
+    imported = 0
+    with zipfile.ZipFile(zip_source) as zf, ThreadPoolExecutor(max_workers=workers) as pool:
+        names = set(zf.namelist())
+        if ROWS_ENTRY not in names:
+            raise ValueError(f"{ROWS_ENTRY} がZIPに含まれていません")
+
+        def prepare(record):
+            row = {k: v for k, v in record.items()
+                   if k not in _SERVER_COLUMNS and k not in ("image_file", "image_error")}
+            row["user_id"] = user_id
+            image_file = record.get("image_file")
+            if image_file in names:
+                row["character_img_url"] = _upload_image(supabase, user_id, zf.read(image_file), record)
+            return row
+
+        batch = []
+        with zf.open(ROWS_ENTRY) as rows_file:
+            for line in io.TextIOWrapper(rows_file, encoding="utf-8"):
+                if not line.strip():
+                    continue
+                batch.append(json.loads(line))
+                if len(batch) >= batch_size:
+                    imported += _insert_batch(supabase, pool, prepare, batch)
+                    batch = []
+                    if on_progress:
+                        on_progress(imported)
+            if batch:
+                imported += _insert_batch(supabase, pool, prepare, batch)
+                if on_progress:
+                    on_progress(imported)
+    return imported
+
+
+def _insert_batch(supabase, pool: ThreadPoolExecutor, prepare, records: list) -> int:
+    rows = list(pool.map(prepare, records))
+    supabase.table(TABLE).insert(rows).execute()
+    return len(rows)
+
+
+def export_filename(stamp: str, number: int = 1, parts: int = 1) -> str:
+    if parts == 1:
+        return f"barcode_battler_collection_{stamp}.zip"
+    return f"barcode_battler_collection_{stamp}_{number}of{parts}.zip"
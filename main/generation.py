@@ -0,0 +1,112 @@
+#キャラクター生成の本体（Streamlitに依存しない部分）
+# 画面側からは on_progress(stage, detail) で進捗を受け取り、
+# GPTのテキストはストリーミングで少しずつ届く（stage="text"）。
+# 通信は services.UpstreamServices を通して共有イベントループの上で行うので、生成関数はコルーチン。
+
+from jan import combat_power_from_jan
+from prompts import (
+    STABILITY_SCHEMA, NAME_SCHEMA, PromptParseError, llm_output_cache,
+    build_stability_messages, build_name_messages, build_openai_image_prompt,
+    parse_structured_output, fallback_character_name,
+)
+
+# 進捗の段階と画面に出す文言
+STAGES = {
+    "lookup": "🔍 商品情報を取得しました",
+    "prompt": "📝 プロンプトができました",
+    "name": "🏷️ キャラクター名が決まりました",
+    "image": "🖼️ 画像ができました",
+    "saved": "💾 保存しました",
+}
+
+# Stability用プロンプトを作るときの max_tokens（英語プロンプト＋名前のJSONが収まる長さ）
+STABILITY_MAX_TOKENS = 600
+
+# スタイル（画面のキャラクターイメージ）ごとのキー
+STYLE_STABILITY = "stability"
+STYLE_OPENAI = "openai"
+
+
+class GenerationError(Exception):
+    """生成に失敗した（画面にそのまま表示できるメッセージを持つ）"""
+
+
+def _notify(on_progress, stage: str, **detail):
+    if on_progress:
+        on_progress(stage, detail)
+
+
+async def _chat_json(services, messages: list, max_tokens: int, on_progress=None) -> str:
+    """ストリーミングの途中経過を stage="text" で通知しながらChatを呼ぶ"""
+    return await services.chat_json(messages, max_tokens, on_text=lambda text: _notify(on_progress, "text", text=text))
+
+
+def _result(product_json: dict, region: str, prompt: str, name: str, image, combat_power: int) -> dict:
+    return {
+        "prompt": prompt,
+        "name": name,
+        "image": image,
+        "barcode": product_json["codeNumber"],
+        "item_name": product_json["itemName"],
+        "region": region,
+        "combat_power": combat_power,
+    }
+
+
+async def generate_with_stability(product_json: dict, region: str, services, on_progress=None, variant: int = 0) -> dict:
+    """GPTでプロンプトと名前を作り、Stability AIで画像を生成する（variant は事前生成の種類の番号）"""
+    jan_code = str(product_json.get("codeNumber", "")).strip()
+    combat_power = combat_power_from_jan(jan_code)
+
+    # LLM出力は (JAN, 地域, スタイル, 種類) でメモ化
+    cache_key = llm_output_cache.make_key(jan_code, region, STYLE_STABILITY, variant)
+    parsed = llm_output_cache.get(cache_key)
+    if parsed is None:
+        generated_text = await _chat_json(services, build_stability_messages(product_json, region), STABILITY_MAX_TOKENS, on_progress)
+        try:
+            parsed = parse_structured_output(generated_text, STABILITY_SCHEMA)
+        except PromptParseError:
+            raise GenerationError("OpenAIでプロンプト生成に失敗しました")
+        llm_output_cache.put(cache_key, parsed)
+
+    sd_prompt = parsed["prompt"]
+    _notify(on_progress, "prompt", prompt=sd_prompt)
+    # キャラクター名が見つからない場合、デフォルト名を生成
+    character_name = parsed.get("character_name") or fallback_character_name()
+    _notify(on_progress, "name", name=character_name)
+
+    image = await services.stability_text_to_image(sd_prompt)
+    _notify(on_progress, "image")
+    return _result(product_json, region, sd_prompt, character_name, image, combat_power)
+
+
+async def generate_character_name(product_json: dict, region: str, services, on_progress=None, variant: int = 0) -> str:
+    """キャラクター名だけを作る（失敗したらデフォルト名）"""
+    jan_code = str(product_json.get("codeNumber", "")).strip()
+    cache_key = llm_output_cache.make_key(jan_code, region, STYLE_OPENAI, variant)
+    parsed = llm_output_cache.get(cache_key)
+    if parsed is None:
+        try:
+            generated_text = await _chat_json(services, build_name_messages(product_json), 40, on_progress)
+            parsed = parse_structured_output(generated_text, NAME_SCHEMA)
+            llm_output_cache.put(cache_key, parsed)
+        except Exception as e:
+            _notify(on_progress, "warning", message=f"キャラクター名生成に失敗しました: {str(e)}")
+            parsed = {}
+    return parsed.get("character_name") or fallback_character_name()
+
+
+async def generate_with_openai(product_json: dict, region: str, services, on_progress=None, variant: int = 0) -> dict:
+    """GPTで名前を作り、OpenAIの画像APIで画像を生成する（variant は事前生成の種類の番号）"""
+    jan_code = str(product_json.get("codeNumber", "")).strip()
+    combat_power = combat_power_from_jan(jan_code)
+
+    character_name = await generate_character_name(product_json, region, services, on_progress, variant)
+    _notify(on_progress, "name", name=character_name)
+
+    sd_prompt = build_openai_image_prompt(product_json, region, character_name)
+    _notify(on_progress, "prompt", prompt=sd_prompt)
+
+    image = await services.openai_image(sd_prompt)
+    _notify(on_progress, "image")
+    return _result(product_json, region, sd_prompt, character_name, image, combat_power)
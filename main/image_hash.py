@@ -0,0 +1,173 @@
+#キャラクター画像の重複検出（知覚ハッシュ）
+# 同じJANを何度も生成して、ほとんど同じ画像が図鑑とストレージに溜まるのを防ぐ。
+# - 画像ごとに 64bit の dHash（縮小したグレー画像の隣り合う画素の明暗）を計算し、
+#   character_parameter.image_hash に16進で保存する
+# - ハミング距離で近い画像を探すのは、マルチインデックスハッシュ（64bitを16bit×4に分けた索引）で行う。
+#   距離 d 以内なら、どれか1つのブロックは d//4 bit 以内しか違わない（鳩の巣原理）ので、
+#   各ブロックでその範囲の値だけを引けば取りこぼしがない。数百万件でも1回の検索で見る候補はごく少ない。
+
+import io
+import os
+import threading
+import time
+from collections import deque
+from itertools import combinations
+
+from PIL import Image
+
+HASH_BITS = 64
+# 索引のブロック数と1ブロックのビット数
+BLOCKS = 4
+BLOCK_BITS = HASH_BITS // BLOCKS
+_BLOCK_MASK = (1 << BLOCK_BITS) - 1
+# この距離以内なら「ほぼ同じ画像」とみなす
+DUPLICATE_DISTANCE = int(os.getenv("DUPLICATE_IMAGE_DISTANCE", "6"))
+# 1ユーザー（owner）あたり索引に残す件数
+MAX_HASHES_PER_OWNER = int(os.getenv("IMAGE_INDEX_MAX_PER_USER", "5000"))
+# この秒数使われていないユーザーの分は索引から消す（次に保存するときに読み直す）
+INDEX_IDLE_SECONDS = int(os.getenv("IMAGE_INDEX_IDLE_SECONDS", "1800"))
+# 使われていないユーザーの掃除を行う間隔（秒）
+_EVICT_INTERVAL = 60
+
+
+def dhash(image, size: int = 8) -> int:
+    """画像（PIL画像 または バイト列）の dHash を整数で返す"""
+    if isinstance(image, (bytes, bytearray)):
+        image = Image.open(io.BytesIO(image))
+    small = image.convert("L").resize((size + 1, size), Image.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for col in range(size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hash_to_hex(value: int) -> str:
+    return f"{value:016x}"
+
+
+def hex_to_hash(text: str) -> int:
+    return int(text, 16)
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def _blocks(value: int):
+    for i in range(BLOCKS):
+        yield i, (value >> (i * BLOCK_BITS)) & _BLOCK_MASK
+
+
+def _neighbors(block: int, radius: int):
+    """block から radius bit 以内だけ違う値をすべて返す"""
+    yield block
+    for r in range(1, radius + 1):
+        for bits in combinations(range(BLOCK_BITS), r):
+            flipped = block
+            for bit in bits:
+                flipped ^= 1 << bit
+            yield flipped
+
+
+class ImageHashIndex:
+    """
+    (owner, ハッシュ) → 値 を登録し、ハミング距離の近いものを探す索引。
+    owner は「同じユーザーの図鑑の中だけで探す」ために使う（None なら全体から探す）。
+    owner ごとの件数に上限を設け、しばらく使われていない owner の分は消す（メモリを増やし続けない）。
+    """
+
+    def __init__(self, max_per_owner: int = MAX_HASHES_PER_OWNER, idle_seconds: int = INDEX_IDLE_SECONDS):
+        self.max_per_owner = max_per_owner
+        self.idle_seconds = idle_seconds
+        self._tables = [dict() for _ in range(BLOCKS)]  # block値 -> [(hash, owner, value), ...]
+        self._owners = {}  # owner -> {"entries": [...], "loaded": bool, "last_used": 時刻}
+        self._lock = threading.Lock()
+        self._last_evict = time.time()
+        self.size = 0
+
+    def _owner(self, owner) -> dict:
+        info = self._owners.get(owner)
+        if info is None:
+            info = self._owners[owner] = {"entries": deque(), "loaded": False, "last_used": time.time()}
+        info["last_used"] = time.time()
+        return info
+
+    def _remove(self, entries):
+        """entries を索引から外す（ロックを持った状態で呼ぶ）"""
+        removed = {id(entry) for entry in entries}
+        for entry in entries:
+            for i, block in _blocks(entry[0]):
+                bucket = self._tables[i].get(block)
+                if bucket is None:
+                    continue
+                bucket[:] = [e for e in bucket if id(e) not in removed]
+                if not bucket:
+                    del self._tables[i][block]
+        self.size -= len(removed)
+
+    def is_loaded(self, owner) -> bool:
+        with self._lock:
+            return self._owner(owner)["loaded"]
+
+    def mark_loaded(self, owner):
+        with self._lock:
+            self._owner(owner)["loaded"] = True
+
+    def add(self, value_hash: int, owner=None, value=None):
+        entry = (value_hash, owner, value)
+        with self._lock:
+            for i, block in _blocks(value_hash):
+                self._tables[i].setdefault(block, []).append(entry)
+            self.size += 1
+            if owner is not None:
+                entries = self._owner(owner)["entries"]
+                entries.append(entry)
+                # 上限を超えたら古いものから外す
+                if len(entries) > self.max_per_owner:
+                    self._remove([entries.popleft()])
+            due = time.time() - self._last_evict > _EVICT_INTERVAL
+        if due:
+            self.evict_idle()
+
+    def evict_idle(self) -> int:
+        """しばらく使われていない owner の分を消す。消した owner の数を返す。"""
+        now = time.time()
+        with self._lock:
+            self._last_evict = now
+            idle = [owner for owner, info in self._owners.items() if now - info["last_used"] > self.idle_seconds]
+            for owner in idle:
+                self._remove(self._owners.pop(owner)["entries"])
+        return len(idle)
+
+    def search(self, value_hash: int, max_distance: int = DUPLICATE_DISTANCE, owner=None) -> list:
+        """距離 max_distance 以内のものを [(距離, hash, owner, value), ...] で近い順に返す"""
+        radius = max_distance // BLOCKS
+        found = {}
+        with self._lock:
+            if owner is not None and owner in self._owners:
+                self._owners[owner]["last_used"] = time.time()
+            for i, block in _blocks(value_hash):
+                table = self._tables[i]
+                for candidate in _neighbors(block, radius):
+                    for entry in table.get(candidate, ()):
+                        distance = (value_hash ^ entry[0]).bit_count()
+                        if distance <= max_distance and (owner is None or entry[1] == owner):
+                            found[id(entry)] = (distance,) + entry
+        return sorted(found.values(), key=lambda item: item[0])
+
+    def nearest(self, value_hash: int, max_distance: int = DUPLICATE_DISTANCE, owner=None):
+        matches = self.search(value_hash, max_distance, owner)
+        return matches[0] if matches else None
+
+    def owners(self) -> int:
+        return len(self._owners)
+
+    def __len__(self):
+        return self.size
+
+
+# プロセス内で共有する索引（保存済みキャラの画像。owner はユーザーID、値は (id, 画像URL)）
+image_index = ImageHashIndex()
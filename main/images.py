@@ -0,0 +1,108 @@
+#キャラクター画像の保存名・キャッシュ・リサイズ
+# - 保存名は画像の中身のハッシュにする（同じ画像は同じURL → ずっとキャッシュしてよい）
+# - アップロード時に長期の cache-control を付ける。上書き（upsert）はしない。
+#   upsert にはバケットの SELECT / UPDATE ポリシーが要るが、ハッシュ名なので同じ名前があれば中身も同じ。
+#   すでにある（409 Duplicate）ときはアップロード済みとして扱う
+# - 表示は縮小した版を使う。Supabaseの画像変換（render/image）が使えればそのURL、
+#   使えなければサーバー側で縮小したものを返す（ローカルのリサイズプロキシ）
+
+import hashlib
+import io
+import os
+from urllib.parse import urlencode
+
+import requests
+from PIL import Image
+
+BUCKET = "character-images"
+# 中身が変わらない（ハッシュ名）ので1年キャッシュしてよい
+CACHE_CONTROL_SECONDS = 31536000
+# Supabaseの画像変換（有料プランの機能）を使うか
+IMAGE_TRANSFORM_ENABLED = os.getenv("SUPABASE_IMAGE_TRANSFORM", "").lower() in ("1", "true", "yes")
+
+THUMBNAIL_WIDTH = 256
+DETAIL_WIDTH = 512
+
+_OBJECT_PATH = "/storage/v1/object/public/"
+_RENDER_PATH = "/storage/v1/render/image/public/"
+
+
+def content_hashed_filename(prefix: str, image_bytes: bytes, ext: str = "png") -> str:
+    """画像の中身から保存名を作る（同じ画像なら同じ名前）"""
+    digest = hashlib.sha256(image_bytes).hexdigest()[:32]
+    return f"{prefix}_{digest}.{ext}"
+
+
+def upload_file_options(content_type: str = "image/png") -> dict:
+    """storage.upload に渡すオプション"""
+    return {
+        "content-type": content_type,
+        "cache-control": str(CACHE_CONTROL_SECONDS),
+        "upsert": "false",
+    }
+
+
+def _is_duplicate(error: Exception) -> bool:
+    """同じ名前のオブジェクトがすでにある（409 Duplicate）エラーか"""
+    # storage3 の StorageApiError は status を、古い版は dict を引数に持つ
+    if str(getattr(error, "status", "")) == "409":
+        return True
+    detail = error.args[0] if error.args else None
+    if isinstance(detail, dict):
+        return str(detail.get("statusCode")) == "409" or detail.get("error") == "Duplicate"
+    return "Duplicate" in str(error) or "already exists" in str(error)
+
+
+def upload_content_hashed(bucket, filename: str, data: bytes, content_type: str = "image/png"):
+    """
+    ハッシュ名のファイルをアップロードし、upload の戻り値を返す。
+    同じ名前がすでにあれば（中身も同じなので）何もせず None を返す。
+    """
+    try:
+        return bucket.upload(filename, data, upload_file_options(content_type))
+    except Exception as e:
+        if not _is_duplicate(e):
+            raise
+        return None
+
+
+async def upload_content_hashed_async(bucket, filename: str, data: bytes, content_type: str = "image/png"):
+    """upload_content_hashed の非同期版（非同期Supabaseクライアントのバケット用）"""
+    try:
+        return await bucket.upload(filename, data, upload_file_options(content_type))
+    except Exception as e:
+        if not _is_duplicate(e):
+            raise
+        return None
+
+
+def upload_image_bytes(supabase, prefix: str, image_bytes: bytes, content_type: str = "image/png") -> str:
+    """画像をハッシュ名でアップロードし、パブリックURLを返す"""
+    ext = content_type.split("/")[-1]
+    filename = content_hashed_filename(prefix, image_bytes, ext)
+    upload_content_hashed(supabase.storage.from_(BUCKET), filename, image_bytes, content_type)
+    return supabase.storage.from_(BUCKET).get_public_url(filename)
+
+
+def transformed_url(public_url: str, width: int, quality: int = 75):
+    """
+    Supabaseの画像変換URLを返す（変換が無効、またはSupabaseの公開URLでなければ None）。
+    元の画像がハッシュ名なので、変換後のURLもCDN・ブラウザでキャッシュされる。
+    """
+    if not IMAGE_TRANSFORM_ENABLED or not public_url or _OBJECT_PATH not in public_url:
+        return None
+    base = public_url.split("?", 1)[0].replace(_OBJECT_PATH, _RENDER_PATH, 1)
+    return f"{base}?{urlencode({'width': width, 'quality': quality, 'resize': 'contain'})}"
+
+
+def resize_image_from_url(url: str, width: int, quality: int = 80) -> bytes:
+    """画像を取得して横幅 width に縮小し、WebPのバイト列を返す（ローカルのリサイズプロキシ）"""
+    response = requests.get(url, timeout=30)
+    response.raise_for_status()
+    image = Image.open(io.BytesIO(response.content))
+    image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+    if image.width > width:
+        image = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+    buffer = io.BytesIO()
+    image.save(buffer, format="WEBP", quality=quality)
+    return buffer.getvalue()
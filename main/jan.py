@@ -0,0 +1,167 @@
+#JAN/EANコードの検証・正規化
+# ネットワークに投げる前に、桁数とチェックディジットをローカルで確認する。
+# EAN-13 / EAN-8 / UPC-A / UPC-E に対応し、UPC系は EAN-13 に揃える。
+
+# 全角数字 → 半角、区切り文字（空白・ハイフン）は削除
+_TRANSLATE = str.maketrans(
+    {**{chr(0xFF10 + i): str(i) for i in range(10)}, " ": None, "　": None, "-": None, "ー": None}
+)
+
+# 桁ごとの重み（右端のチェックディジットを除き、右から 3,1,3,1,...）
+_WEIGHTS = {n: tuple(3 if (n - i) % 2 else 1 for i in range(n)) for n in (7, 11, 12)}
+
+# JAN として受け付ける桁数
+_LENGTHS = (8, 12, 13)
+
+
+def _digit_slices(n: int) -> tuple:
+    """チェックディジット込み n 桁のうち、重み3の桁・重み1の桁を取り出すスライスと、文字コード（'0' = 48）の補正値"""
+    threes = slice(n % 2, n - 1, 2)
+    ones = slice(1 - n % 2, n - 1, 2)
+    count3, count1 = len(range(n)[threes]), len(range(n)[ones])
+    return threes, ones, 48 * (3 * count3 + count1)
+
+
+# 桁数ごとのスライスは前もって計算しておく
+_SLICES = {n: _digit_slices(n) for n in _LENGTHS}
+
+# pyzbar / zxingcpp が返す種類名のうち、JANとして扱うもの
+UPCE_TYPES = ("UPCE", "UPC-E", "UPC_E")
+JAN_TYPES = ("EAN13", "EAN-13", "EAN_13", "EAN8", "EAN-8", "EAN_8", "UPCA", "UPC-A", "UPC_A") + UPCE_TYPES
+
+
+def check_digit(body: str) -> int:
+    """チェックディジットを除いた部分から、チェックディジットを計算する"""
+    weights = _WEIGHTS.get(len(body)) or tuple(3 if (len(body) - i) % 2 else 1 for i in range(len(body)))
+    total = sum(w * (ord(ch) - 48) for w, ch in zip(weights, body))
+    return (10 - total % 10) % 10
+
+
+def has_valid_check_digit(code: str) -> bool:
+    """code は半角数字だけの文字列。桁ごとのループをせず、重みの同じ桁をまとめて足す。"""
+    n = len(code)
+    threes, ones, bias = _SLICES.get(n) or _digit_slices(n)
+    data = code.encode("ascii")
+    total = 3 * sum(data[threes]) + sum(data[ones]) - bias
+    return data[-1] - 48 == (10 - total % 10) % 10
+
+
+def upce_to_upca(code: str) -> str:
+    """UPC-E（8桁）を UPC-A（12桁）に展開する"""
+    ns, d, check = code[0], code[1:7], code[7]
+    last = d[5]
+    if last in "012":
+        body = d[0:2] + last + "0000" + d[2:5]
+    elif last == "3":
+        body = d[0:3] + "00000" + d[3:5]
+    elif last == "4":
+        body = d[0:4] + "00000" + d[4]
+    else:
+        body = d[0:5] + "0000" + last
+    return ns + body + check
+
+
+def clean_digits(raw) -> str:
+    """入力から区切り文字を除き、全角数字を半角にする"""
+    return str(raw or "").strip().translate(_TRANSLATE)
+
+
+def normalize_jan(raw, symbology: str = None):
+    """
+    JAN/EAN/UPC を正規化して返す。不正なら None。
+    - EAN-13 はそのまま、UPC-A は先頭に0を付けて EAN-13 に
+    - EAN-8 はそのまま（symbology が UPC-E の場合は展開して EAN-13 に）
+    """
+    code = clean_digits(raw)
+    if not code.isdigit() or not code.isascii():
+        return None
+
+    n = len(code)
+    if n == 8 and symbology and symbology.upper() in UPCE_TYPES:
+        if code[0] not in "01":
+            return None
+        code = upce_to_upca(code)
+        n = 12
+    if n not in _LENGTHS:
+        return None
+    if not has_valid_check_digit(code):
+        return None
+    return "0" + code if n == 12 else code
+
+
+def normalize_many(items, key=None, symbology: str = None):
+    """
+    normalize_jan のバッチ版（カタログ取り込み・JAN一覧の読み込み用）。
+    items を1件ずつ読み、(item, 正規化したコード または None) を入力と同じ順で返す。
+    key を渡すと item からコードを取り出す関数として使う。
+    ジェネレータなので、数百万行のファイルでも一覧全体をメモリに載せない。
+    すでに半角数字だけのコード（CSVなどではほとんどがそう）は区切り文字の除去・全角変換を飛ばし、
+    桁数の確認とチェックディジットだけで済ませる。それ以外は normalize_jan に任せる。
+    """
+    upce = bool(symbology) and symbology.upper() in UPCE_TYPES
+    for item in items:
+        raw = key(item) if key else item
+        if upce or type(raw) is not str or len(raw) not in _SLICES or not (raw.isascii() and raw.isdigit()):
+            yield item, normalize_jan(raw, symbology)
+        elif has_valid_check_digit(raw):
+            yield item, "0" + raw if len(raw) == 12 else raw
+        else:
+            yield item, None
+
+
+def explain_invalid(raw) -> str:
+    """不正な入力に対して、画面に出すための理由を返す（正しければ空文字）"""
+    code = clean_digits(raw)
+    if not code:
+        return "JANコードが入力されていません。"
+    if not code.isdigit() or not code.isascii():
+        return "JANコードは数字だけで入力してください。"
+    if len(code) not in _LENGTHS:
+        return f"JANコードは8桁または13桁です（UPCは12桁、入力: {len(code)}桁）。"
+    if not has_valid_check_digit(code):
+        return "チェックディジットが一致しません。入力ミスがないか確認してください。"
+    return ""
+
+
+# === 戦闘力ロジック（最終版） ===
+_SEQS = ("123", "234", "345", "456", "567", "678", "789", "890", "901", "012")
+# 戦闘力の上限
+COMBAT_POWER_MAX = 13700
+
+
+def combat_power_from_jan(jan_raw: str) -> int:
+    """JANコード13桁から戦闘力を計算する（UPC-A は EAN-13 に揃えてから計算）"""
+    jan = normalize_jan(jan_raw) or "".join(ch for ch in str(jan_raw) if ch.isdigit())
+    if len(jan) != 13:
+        return 0  # 13桁でない場合は0
+
+    digits = [int(ch) for ch in jan]
+
+    # ベース戦闘力：合計値 % 100 * 100
+    base = (sum(digits) % 100) * 100
+
+    bonus = 0
+
+    # ぞろ目（同じ数字が3連続以上）
+    for i in range(len(digits) - 2):
+        if digits[i] == digits[i+1] == digits[i+2]:
+            bonus += 1000
+            break
+
+    # 連番（123, 456, …, 890, 901, 012）
+    for i in range(len(jan) - 2):
+        if jan[i:i+3] in _SEQS:
+            bonus += 500
+            break
+
+    # 下二桁が "00"
+    if jan.endswith("00"):
+        bonus += 2000
+
+    # 偶数が全体の半分以上
+    even_count = sum(1 for d in digits if d % 2 == 0)
+    if even_count >= len(digits) / 2:
+        bonus += 300
+
+    total = base + bonus
+    return min(total, COMBAT_POWER_MAX)
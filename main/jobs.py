@@ -0,0 +1,239 @@
+#生成リクエストの重複排除（リクエストの合流）
+# 同じ (JAN, 地域, スタイル) の生成が実行中なら、新しく始めずに同じジョブを共有する。
+# ジョブはバックグラウンドのスレッドで動き、画面側は進捗イベントをポーリングして表示する。
+# セッションにはジョブのIDだけを持たせ、再実行（rerun）後も同じジョブに戻れるようにする。
+# 同じセッションが同じキーをもう一度送ったとき（二度押し）は、終わっていても受け取るまでは同じジョブを返す。
+# コルーチン関数のジョブは共有イベントループ（services.py）で動くので、スレッドを占有しない。
+# 結果（画像）は合流した全セッションが保存し終えた時点で手放し、終わったジョブは定期的に掃除する。
+
+import inspect
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from services import submit as submit_coroutine
+from session_store import estimate_size
+
+# 同時に走らせる生成ジョブの上限
+MAX_WORKERS = int(os.getenv("GENERATION_WORKERS", "8"))
+# 終わったジョブを（再接続のために）残しておく秒数
+RETENTION_SECONDS = 300
+# 終わったジョブを掃除する間隔（秒）
+PRUNE_INTERVAL = 30
+
+
+class GenerationJob:
+    """1つの生成ジョブ。進捗イベントを溜めておき、複数のセッションから読めるようにする。"""
+
+    def __init__(self, key: tuple):
+        self.key = key
+        self.id = uuid.uuid4().hex
+        self.future = None
+        self.created_at = time.time()
+        self.finished_at = None
+        # 合流したセッションと、結果を保存し終えたセッション
+        self.subscribers = set()
+        self.readers = set()
+        self._result = None
+        self._error = None
+        self._events = []
+        # ストリーミング中のテキストは最新だけを版番号つきで持つ（イベント列には入れない）
+        self._text = None
+        self._text_version = 0
+        self._lock = threading.Lock()
+
+    def on_progress(self, stage: str, detail: dict):
+        """generation.py の on_progress として渡すコールバック"""
+        with self._lock:
+            if stage == "text":
+                self._text = detail
+                self._text_version += 1
+            else:
+                self._events.append((stage, detail))
+
+    def events_since(self, index: int) -> list:
+        with self._lock:
+            return self._events[index:]
+
+    def text_since(self, version: int):
+        """version より新しいテキストがあれば (版番号, detail) を、なければ None を返す"""
+        with self._lock:
+            if self._text_version > version:
+                return self._text_version, self._text
+            return None
+
+    def _finish(self, future):
+        """完了時のコールバック。結果を取り出して future は手放す。"""
+        try:
+            self._result = future.result()
+        except BaseException as e:
+            self._error = e
+        self.future = None
+        with self._lock:
+            self.finished_at = time.time()
+            # 待っていた全員が先に抜けていれば、結果はもう要らない
+            self._release_if_read()
+
+    def done(self) -> bool:
+        return self.finished_at is not None
+
+    def result(self):
+        """結果を返す（失敗していれば例外を送出する）。結果は手放さない。"""
+        with self._lock:
+            result, error = self._result, self._error
+        if error is not None:
+            raise error
+        return result
+
+    def subscribe(self, subscriber) -> bool:
+        """subscriber を合流させる。新しく合流したなら True（すでに合流していれば False）"""
+        with self._lock:
+            # 一度諦めたセッションが送り直した場合は、また受け取るまで結果を手放さない
+            self.readers.discard(subscriber)
+            if subscriber in self.subscribers:
+                return False
+            self.subscribers.add(subscriber)
+            return True
+
+    def unread_by(self, subscriber) -> bool:
+        """subscriber が合流していて、まだ結果を保存し終えていなければ True"""
+        with self._lock:
+            return subscriber in self.subscribers and subscriber not in self.readers
+
+    def mark_read(self, subscriber):
+        """
+        subscriber が結果を保存し終えた（または諦めた）ことを記録する。
+        合流した全員がそうなったら、ジョブは結果を手放す。
+        """
+        with self._lock:
+            self.readers.add(subscriber)
+            self._release_if_read()
+
+    def _release_if_read(self):
+        if self.finished_at is not None and self.subscribers <= self.readers:
+            self.release()
+
+    def release(self):
+        self._result = None
+        self._error = None
+
+    def result_bytes(self) -> int:
+        """まだ手放していない結果のおおよそのサイズ（バイト）"""
+        result = self._result
+        return estimate_size(result) if result is not None else 0
+
+
+class JobRegistry:
+    """
+    実行中・直近に終わったジョブをキー（合流用）とID（再接続用）で管理する。
+    Streamlitの全セッションで共有する。
+    """
+
+    def __init__(self, max_workers: int = MAX_WORKERS, retention: float = RETENTION_SECONDS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="generation")
+        self._jobs = {}  # キー -> 最新のジョブ
+        self._by_id = {}  # ID -> ジョブ（同じキーで新しいジョブが始まっても、前のジョブに戻れるように）
+        self._lock = threading.Lock()
+        self.retention = retention
+        self.started = 0
+        self.coalesced = 0
+        # submit が来なくても終わったジョブを掃除する
+        threading.Thread(target=self._prune_loop, name="job-pruner", daemon=True).start()
+
+    @staticmethod
+    def make_key(jan_code: str, region: str, style: str) -> tuple:
+        return (str(jan_code), region, style)
+
+    def _prune(self):
+        now = time.time()
+        for job_id, job in list(self._by_id.items()):
+            if job.finished_at and now - job.finished_at > self.retention:
+                job.release()
+                del self._by_id[job_id]
+                if self._jobs.get(job.key) is job:
+                    del self._jobs[job.key]
+
+    def _prune_loop(self):
+        while True:
+            time.sleep(PRUNE_INTERVAL)
+            with self._lock:
+                self._prune()
+
+    def get(self, job_id: str):
+        with self._lock:
+            return self._by_id.get(job_id)
+
+    def submit(self, key: tuple, fn, *args, subscriber=None, **kwargs) -> GenerationJob:
+        """
+        key のジョブが実行中ならそれを返し、なければ fn(*args, on_progress=..., **kwargs) を新しく実行する。
+        fn がコルーチン関数なら共有イベントループで、そうでなければスレッドプールで動かす。
+        終わったジョブは、subscriber がまだ結果を保存していなければ返す（二度押し）。
+        保存済みなら再利用しない（もう一度生成したい場合のため）。
+        """
+        key = tuple(key)
+        with self._lock:
+            self._prune()
+            job = self._jobs.get(key)
+            if job is not None and (not job.done() or job.unread_by(subscriber)):
+                # 同じセッションが送り直しただけなら合流の数には入れない
+                if job.subscribe(subscriber):
+                    self.coalesced += 1
+                return job
+
+            job = GenerationJob(key)
+            job.subscribe(subscriber)
+            self._jobs[key] = job
+            self._by_id[job.id] = job
+            self.started += 1
+
+        if inspect.iscoroutinefunction(fn):
+            job.future = submit_coroutine(fn(*args, on_progress=job.on_progress, **kwargs))
+        else:
+            job.future = self._executor.submit(fn, *args, on_progress=job.on_progress, **kwargs)
+        job.future.add_done_callback(job._finish)
+        return job
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return sum(1 for job in self._by_id.values() if not job.done())
+
+    def retained(self) -> tuple:
+        """結果を手放していないジョブの (件数, 合計バイト数)"""
+        with self._lock:
+            sizes = [job.result_bytes() for job in self._by_id.values()]
+        sizes = [size for size in sizes if size]
+        return len(sizes), sum(sizes)
+
+
+# プロセス内で共有するレジストリ
+job_registry = JobRegistry()
+
+
+def wait_for_job(job: GenerationJob, on_progress=None, poll_interval: float = 0.25, timeout: float = 180):
+    """
+    ジョブの完了を待ちながら、溜まった進捗イベントを on_progress に流す。
+    ジョブの結果を返す（失敗していれば例外を送出する）。
+    結果は手放さないので、受け取った側は保存し終えたら job.mark_read を呼ぶ。
+    """
+    seen = 0
+    text_version = 0
+    deadline = time.time() + timeout
+    while True:
+        finished = job.done()
+        # テキストを先に流す（後に続く段階のイベントで表示が片付くように）
+        text = job.text_since(text_version)
+        events = job.events_since(seen)
+        seen += len(events)
+        if on_progress:
+            if text is not None:
+                text_version = text[0]
+                on_progress("text", text[1])
+            for stage, detail in events:
+                on_progress(stage, detail)
+        if finished:
+            return job.result()
+        if time.time() > deadline:
+            raise TimeoutError("キャラクター生成がタイムアウトしました")
+        time.sleep(poll_interval)
@@ -0,0 +1,23 @@
+#user_operations を id のキーセットページングで読む
+# OFFSET を使わないので、後ろのページでも遅くならない。テーブル全体をメモリに載せずに済む。
+# 図鑑のエクスポート・バックフィル・重複画像の索引・トーナメントの出場者読み込みで共通に使う。
+
+TABLE = "user_operations"
+
+
+def iter_row_chunks(supabase, chunk_size: int = 500, after_id=None, columns: str = "*", user_id: str = None):
+    """id の昇順に chunk_size 行ずつ返す。user_id を渡すとそのユーザーの行だけ。"""
+    while True:
+        query = supabase.table(TABLE).select(columns)
+        if user_id is not None:
+            query = query.eq("user_id", user_id)
+        query = query.order("id").limit(chunk_size)
+        if after_id is not None:
+            query = query.gt("id", after_id)
+        rows = query.execute().data or []
+        if not rows:
+            return
+        yield rows
+        after_id = rows[-1]["id"]
+        if len(rows) < chunk_size:
+            return
@@ -0,0 +1,154 @@
+#ライブスキャン（カメラ映像を流しながらバーコードを読む）
+# streamlit-webrtc で映像を受け取り、バックグラウンドのスレッドでデコードする。
+# - 数フレームに1回だけデコード（フレームスキップ）
+# - デコード待ちは最新の1フレームだけ（古いフレームは捨てる）
+# - 正しいJANが1つ読めたらそこで終了（ストリームも止める）
+# - 読めるのを待つ間もページの残りは表示する（状態の確認は st.fragment で定期的に行う）
+# streamlit-webrtc が入っていない環境では HAS_WEBRTC = False になり、撮影モードだけ使える。
+
+import os
+import queue
+import threading
+import time
+
+import streamlit as st
+from pyzbar.pyzbar import decode as pyzbar_decode
+
+from jan import JAN_TYPES, normalize_jan
+
+try:
+    import zxingcpp
+except ImportError:
+    zxingcpp = None
+
+try:
+    from streamlit_webrtc import WebRtcMode, webrtc_streamer
+    HAS_WEBRTC = True
+except ImportError:
+    HAS_WEBRTC = False
+
+# 何フレームに1回デコードするか
+FRAME_SKIP = int(os.getenv("LIVE_SCAN_FRAME_SKIP", "3"))
+
+
+def decode_jan(img):
+    """
+    画像からJANを読む。pyzbar で読めなければ zxingcpp（入っていれば）も試す。
+    正しいJANが読めたら (正規化したコード, 種類) を、読めなければ None を返す。
+    """
+    for result in pyzbar_decode(img):
+        if result.type in JAN_TYPES:
+            code = normalize_jan(result.data.decode("utf-8"), result.type)
+            if code:
+                return code, result.type
+    if zxingcpp is not None:
+        for result in zxingcpp.read_barcodes(img):
+            symbology = str(result.format).rsplit(".", 1)[-1]
+            code = normalize_jan(result.text, symbology)
+            if code:
+                return code, symbology
+    return None
+
+
+class LiveBarcodeProcessor:
+    """
+    streamlit-webrtc の video_processor_factory に渡すクラス。
+    recv() は映像のスレッドで呼ばれるので、ここではフレームを渡すだけにしてすぐ返す。
+    """
+
+    def __init__(self, frame_skip: int = FRAME_SKIP):
+        self.frame_skip = max(1, frame_skip)
+        self.frames_received = 0
+        self.frames_decoded = 0
+        self.started_at = time.perf_counter()
+        self.result = None
+        self.time_to_first_read = None
+        self._queue = queue.Queue(maxsize=1)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._decode_loop, daemon=True)
+        self._thread.start()
+
+    def recv(self, frame):
+        self.frames_received += 1
+        if self.result is None and self.frames_received % self.frame_skip == 0:
+            try:
+                self._queue.put_nowait(frame.to_image())
+            except queue.Full:
+                # デコードが追いついていないときは、待たせている古いフレームと入れ替える
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    pass
+                self._queue.put_nowait(frame.to_image())
+        return frame
+
+    def _decode_loop(self):
+        while not self._stop.is_set() and self.result is None:
+            try:
+                img = self._queue.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            self.frames_decoded += 1
+            found = decode_jan(img)
+            if found:
+                self.time_to_first_read = time.perf_counter() - self.started_at
+                self.result = found
+
+    def stats(self) -> dict:
+        elapsed = max(time.perf_counter() - self.started_at, 1e-6)
+        return {
+            "fps": self.frames_received / elapsed,
+            "decoded_fps": self.frames_decoded / elapsed,
+            "time_to_first_read": self.time_to_first_read,
+        }
+
+    def on_ended(self):
+        self._stop.set()
+
+
+def _result_key(key: str) -> str:
+    return f"{key}_result"
+
+
+def reset_live_scan(key: str = "live-scan"):
+    """読み取り結果を捨てて、もう一度ライブスキャンできるようにする"""
+    st.session_state.pop(_result_key(key), None)
+
+
+@st.fragment(run_every=0.5)
+def _watch_live_scan(ctx, key: str):
+    """
+    ライブスキャンの状態を見る部分だけを定期的に再実行する。
+    JANが読めたら session_state に残してページ全体を再実行する（そこで映像を止める）。
+    """
+    processor = ctx.video_processor
+    if not (ctx.state.playing and processor):
+        return
+    stats = processor.stats()
+    st.caption(f"📹 {stats['fps']:.1f} fps（デコード {stats['decoded_fps']:.1f} fps）")
+    if processor.result:
+        code, symbology = processor.result
+        st.session_state[_result_key(key)] = (code, symbology, stats)
+        st.rerun(scope="app")
+
+
+def live_scan(key: str = "live-scan"):
+    """
+    ライブスキャンの画面部品。JANが読めていれば (コード, 種類, 統計) を、まだなら None を返す。
+    待っている間もページの残りは表示される（読めたかどうかは _watch_live_scan が見に行く）。
+    映像はブラウザからの送信だけ（SENDONLY）で、読めたらストリームを止める。
+    """
+    scanned = st.session_state.get(_result_key(key))
+    ctx = webrtc_streamer(
+        key=key,
+        mode=WebRtcMode.SENDONLY,
+        video_processor_factory=LiveBarcodeProcessor,
+        media_stream_constraints={"video": True, "audio": False},
+        async_processing=True,
+        desired_playing_state=False if scanned else None,
+    )
+    if scanned:
+        st.button("🔄 もう一度読み取る", key=f"{key}_again", on_click=reset_live_scan, args=(key,))
+        return scanned
+    _watch_live_scan(ctx, key)
+    return None
@@ -1,25 +1,47 @@
-import os, io, re, json, base64, zipfile, random, time
-from PIL import Image #画像ファイルを使用する（バーコード読み込み時や画像生成時）
+import os, io, re, random
 import streamlit as st #streamlitを使う
-from pyzbar.pyzbar import decode # import zxingcpp から変更。(pythonでしか使用しないため)
 from supabase import create_client, AuthApiError #supabaseを使う
 #open aiを使う
-from openai import OpenAI
 from openai import RateLimitError, APIStatusError
 
 #stabilityで使う
-from io import BytesIO
-from PIL import Image
 import requests
 
 
 #画像保存で使う
 import uuid
-import time
-from io import BytesIO
 
-#JANCODEで使う
-from urllib.parse import urlencode
+#JANコードの検証・戦闘力で使う
+from jan import COMBAT_POWER_MAX, normalize_jan, explain_invalid
+
+#スキャン画面の共通部品（都道府県・バーコード読み取り・画面のキャラクター）で使う
+from prefectures import PREFECTURES
+from scan import go_to, scan_code_input, select_prefecture, make_character, remember_character
+
+#商品カタログ（ローカル）で使う
+from catalog import PRODUCT_FIELDS, catalog
+
+#キャラクター生成で使う
+from generation import STAGES, STYLE_STABILITY, STYLE_OPENAI, generate_with_stability, generate_with_openai
+from services import StabilityConfig, UpstreamServices, create_session_supabase, run_sync
+from jobs import job_registry, wait_for_job
+from prewarm import prewarm_pool
+
+#画像の保存名・キャッシュ・縮小表示で使う
+from images import (
+    THUMBNAIL_WIDTH, DETAIL_WIDTH, content_hashed_filename, upload_content_hashed_async,
+    transformed_url, resize_image_from_url,
+)
+
+#セッションのメモリ管理で使う
+from session_store import blob_store, session_memory, estimate_size
+
+#図鑑のエクスポート・インポートで使う
+from collection_io import export_collection, import_collection, publish_export
+
+#似た画像（重複）の検出で使う
+from image_hash import DUPLICATE_DISTANCE, image_index, dhash, hash_to_hex, hex_to_hash
+from keyset import iter_row_chunks
 
 
 
@@ -46,11 +68,32 @@ def get_secret_or_env(name: str) -> str:
 #SUPABASEを使うための情報
 API_URL = get_secret_or_env("SUPABASE_URL")
 API_KEY = get_secret_or_env("SUPABASE_KEY")
-supabase = create_client(API_URL, API_KEY)
+
+def get_supabase():
+    """
+    セッションごとのSupabaseクライアント。
+    ログイン状態（トークン）はクライアントが持つので、全セッションで1つを共有しない。
+    """
+    if "supabase_client" not in st.session_state:
+        st.session_state.supabase_client = create_client(API_URL, API_KEY)
+    return st.session_state.supabase_client
+
+def get_async_supabase():
+    """
+    セッションごとの非同期Supabaseクライアント（共有イベントループの上で run_sync で待つ）。
+    データの読み書き・画像のアップロードに使う。ログイン状態は get_supabase() が持ち、
+    アクセストークンが変わったら（ログイン・ログアウト・更新）作り直す。
+    """
+    session = get_supabase().auth.get_session()
+    token = session.access_token if session else None
+    cached = st.session_state.get("async_supabase")
+    if cached is None or cached[0] != token:
+        cached = (token, run_sync(create_session_supabase(API_URL, API_KEY, token), timeout=10))
+        st.session_state.async_supabase = cached
+    return cached[1]
 
 #OPENAPIを使うための情報
 OPENAPI_KEY = get_secret_or_env("OPENAI_API_KEY")
-client = OpenAI(api_key=OPENAPI_KEY)
 
 #画像生成APIを使う準備
 engine_id = "stable-diffusion-xl-1024-v1-0"
@@ -61,37 +104,38 @@ if stability_api_key is None:
 
 # JANCODE LOOKUPを使う準備①｜設定
 JANCODE_APP_ID = get_secret_or_env("JANCODE_APP_ID")  # .env or st.secrets に追加しておく
-JANCODE_BASE = "https://api.jancodelookup.com/"
-
-@st.cache_data(ttl=300)  # 同じJANは5分キャッシュ
-def fetch_product_by_jan(jan_code: str, hits: int = 10) -> dict:
-    """jancodelookup の code 検索（前方一致）。生のJSONを返す。"""
-    params = {"appId": JANCODE_APP_ID, "query": jan_code, "hits": hits, "type": "code"}
-    r = requests.get(JANCODE_BASE, params=params, timeout=10)
-    r.raise_for_status()
-    return r.json()
-
-#JANCODE LOOKUPを使う準備②｜API
-from urllib.parse import urlencode
+JANCODE_BASE = os.getenv("JANCODE_API_BASE", "https://api.jancodelookup.com/")
+
+# 外部API（OpenAI・Stability・jancodelookup）は共有イベントループ上の非同期サービスで呼ぶ
+@st.cache_resource
+def get_services() -> UpstreamServices:
+    """全セッションで共有する非同期サービス（画面からは run_sync で待つ）"""
+    return UpstreamServices(
+        openai_api_key=OPENAPI_KEY,
+        stability=StabilityConfig(api_host=stability_api_host, api_key=stability_api_key, engine_id=engine_id),
+        jancode_app_id=JANCODE_APP_ID,
+        jancode_base=JANCODE_BASE,
+    )
 
-JANCODE_APP_ID = get_secret_or_env("JANCODE_APP_ID")
-JANCODE_BASE_URL = "https://api.jancodelookup.com/"
+# ローカルカタログだけで動かす（イベント用・APIを呼ばない）
+JANCODE_OFFLINE = os.getenv("JANCODE_OFFLINE", "").lower() in ("1", "true", "yes")
 
 # JANCODEを使うための関数
 def lookup_by_code(jan_code: str, hits: int = 1):
-    """JANコードから商品情報を取得"""
-    params = {
-        "appId": JANCODE_APP_ID,
-        "query": jan_code,
-        "hits": hits,
-        "type": "code",   # JANコード検索
-    }
-    url = f"{JANCODE_BASE_URL}?{urlencode(params)}"
+    """JANコードから商品情報を取得（ローカルカタログ → API の順）"""
+    # 不正なコードはネットワークに投げずにここで弾く
+    jan_code = normalize_jan(jan_code)
+    if not jan_code:
+        return None
+
+    local_products = catalog.search(jan_code, hits=hits)
+    if local_products:
+        return local_products[0]
+    if JANCODE_OFFLINE:
+        return None
+
     try:
-        r = requests.get(JANCODE_BASE_URL, params=params, timeout=10)
-        r.raise_for_status()
-        data = r.json()
-        products = data.get("product") or []
+        products = run_sync(get_services().lookup_products(jan_code, hits), timeout=15)
         if not products:
             return None
         return products[0]  # 最初の1件を返す
@@ -99,46 +143,6 @@ def lookup_by_code(jan_code: str, hits: int = 1):
         st.error(f"JANコード検索エラー: {e}")
         return None
 
-# === 戦闘力ロジック（最終版） ===
-def combat_power_from_jan(jan_raw: str) -> int:
-    """JANコード13桁から戦闘力を計算する"""
-    jan = "".join(ch for ch in str(jan_raw) if ch.isdigit())
-    if len(jan) != 13:
-        return 0  # 13桁でない場合は0
-
-    digits = [int(ch) for ch in jan]
-
-    # ベース戦闘力：合計値 % 100 * 100
-    base = (sum(digits) % 100) * 100
-
-    bonus = 0
-
-    # ぞろ目（同じ数字が3連続以上）
-    for i in range(len(digits) - 2):
-        if digits[i] == digits[i+1] == digits[i+2]:
-            bonus += 1000
-            break
-
-    # 連番（123, 456, …, 890, 901, 012）
-    seqs = ["123","234","345","456","567","678","789","890","901","012"]
-    for i in range(len(jan) - 2):
-        if jan[i:i+3] in seqs:
-            bonus += 500
-            break
-
-    # 下二桁が "00"
-    if jan.endswith("00"):
-        bonus += 2000
-
-    # 偶数が全体の半分以上
-    even_count = sum(1 for d in digits if d % 2 == 0)
-    if even_count >= len(digits) / 2:
-        bonus += 300
-
-    total = base + bonus
-    return min(total, 13700)  # 上限
-
-
 # 完全Auth UID統一版のヘルパー関数
 
 def sanitize_filename(filename: str) -> str:
@@ -164,29 +168,29 @@ def sanitize_filename(filename: str) -> str:
     return sanitized
 
 
-def upload_character_image_to_storage(image: Image, character_name: str, barcode: str) -> str:
+def upload_character_image_to_storage(image, character_name: str, barcode: str) -> str:
     """
-    キャラクター画像をSupabaseストレージにアップロードし、パブリックURLを返す
+    キャラクター画像（PIL画像 または PNGのバイト列）をSupabaseストレージにアップロードし、パブリックURLを返す
     """
     try:
         # 画像をバイト配列に変換
-        img_buffer = io.BytesIO()
-        image.save(img_buffer, format='PNG')
-        img_bytes = img_buffer.getvalue()
+        if isinstance(image, bytes):
+            img_bytes = image
+        else:
+            img_buffer = io.BytesIO()
+            image.save(img_buffer, format='PNG')
+            img_bytes = img_buffer.getvalue()
         
-        # ファイル名を生成（ユニークになるように、日本語を安全な形式に変換）
+        # ファイル名を生成（画像の中身のハッシュを含める。日本語は安全な形式に変換）
+        # 同じ画像は同じURLになるので、長期キャッシュ（cache-control）を付けてよい
         user_id = st.session_state.user.id
-        timestamp = int(time.time())
         safe_character_name = sanitize_filename(character_name)
-        filename = f"characters/{user_id}_{barcode}_{timestamp}_{safe_character_name}.png"
-        
+        filename = content_hashed_filename(f"characters/{user_id}_{barcode}_{safe_character_name}", img_bytes)
 
-        
         # Supabaseストレージにアップロード
-        response = supabase.storage.from_('character-images').upload(filename, img_bytes, {
-            'content-type': 'image/png',
-            'upsert': 'false'
-        })
+        # （同じ画像がすでにあればアップロード済みとして扱う）
+        bucket = get_async_supabase().storage.from_('character-images')
+        response = run_sync(upload_content_hashed_async(bucket, filename, img_bytes), timeout=60)
         
         # アップロード成功判定（エラーチェック）
         if hasattr(response, 'error') and response.error:
@@ -196,7 +200,7 @@ def upload_character_image_to_storage(image: Image, character_name: str, barcode
             return None
         
         # パブリックURLを取得（文字列として直接返される）
-        public_url = supabase.storage.from_('character-images').get_public_url(filename)
+        public_url = run_sync(bucket.get_public_url(filename), timeout=10)
         
         return public_url
             
@@ -204,38 +208,55 @@ def upload_character_image_to_storage(image: Image, character_name: str, barcode
         st.error(f"画像アップロードエラー: {str(e)}")
         return None
 
-def create_user_profile_unified(auth_user_id: str, email: str, full_name: str = ""):
+def profile_from_auth_user(user) -> dict:
     """
-    完全統一版：Auth UIDをそのままuser_idとして使用してプロフィール作成
+    ログイン結果のユーザー情報（user_metadata）からプロフィールを作る。
+    users テーブルの行はサインアップ時にDBのトリガーが同じ内容で作るので、
+    ログインのたびに問い合わせる必要はない（sql/users_profile_trigger.sql）。
     """
-    try:
-        profile_data = {
-            "user_id": auth_user_id,  # Auth UIDをそのままuser_idとして使用
-            "mail_address": email,
-            "user_name": full_name or email.split('@')[0],
-        }
-        
-        response = supabase.table('users').insert(profile_data).execute()
-        return response.data[0] if response.data else None
-        
-    except Exception as e:
-        st.error(f"プロフィール作成エラー: {str(e)}")
-        return None
+    metadata = getattr(user, "user_metadata", None) or {}
+    return {
+        "user_id": user.id,
+        "mail_address": user.email,
+        "user_name": metadata.get("full_name") or (user.email or "").split('@')[0],
+    }
 
-def get_user_profile_unified(auth_user_id: str):
+#画像を保存する用の関数
+# ほぼ同じ画像がすでに図鑑にあるときの扱い
+#   warn:  警告だけ出して普通に保存する（既定）
+#   reuse: 保存済みの画像を使い回す（ストレージには上げない。いま生成した画像は保存されず、
+#          名前・プロンプトと画像が一致しなくなるので、容量を優先したいときだけ使う）
+#   block: 保存しない
+DUPLICATE_IMAGE_POLICY = os.getenv("DUPLICATE_IMAGE_POLICY", "warn")
+
+
+def load_user_image_hashes(user_id: str):
+    """ユーザーの保存済み画像のハッシュを索引に読み込む（プロセスでユーザーごとに1回だけ）"""
+    if image_index.is_loaded(user_id):
+        return
+    columns = 'id, character_img_url, image_hash:character_parameter->>image_hash'
+    for rows in iter_row_chunks(get_supabase(), 1000, columns=columns, user_id=user_id):
+        for row in rows:
+            if row.get('image_hash') and row.get('character_img_url'):
+                image_index.add(hex_to_hash(row['image_hash']), user_id, (row['id'], row['character_img_url']))
+    image_index.mark_loaded(user_id)
+
+
+def find_duplicate_image(user_id: str, character_image):
     """
-    完全統一版：Auth UIDで直接プロフィール取得
+    画像のハッシュを計算し、同じユーザーの図鑑にほぼ同じ画像があれば探す。
+    (ハッシュ, 見つかった (id, 画像URL) または None) を返す。
     """
-    try:
-        response = supabase.table('users').select('*').eq('user_id', auth_user_id).execute()
-        return response.data[0] if response.data else None
-    except Exception:
-        return None
+    image_hash = dhash(character_image)
+    load_user_image_hashes(user_id)
+    match = image_index.nearest(image_hash, DUPLICATE_DISTANCE, owner=user_id)
+    return image_hash, (match[3] if match else None)
 
-#画像を保存する用の関数
-def save_character_to_db_unified(character_data: dict, character_image: Image = None):
+
+def save_character_to_db_unified(character_data: dict, character_image=None):
     """
     完全統一版：Auth UIDを直接使用してキャラクター保存（画像アップロード機能付き）
+    ほぼ同じ画像が図鑑にあれば、DUPLICATE_IMAGE_POLICY に従って使い回す・警告する・保存しない。
     """
     if 'user' not in st.session_state or not st.session_state.user:
         st.error("認証情報が見つかりません")
@@ -245,7 +266,23 @@ def save_character_to_db_unified(character_data: dict, character_image: Image =
         # Auth UIDを直接使用
         character_data["user_id"] = st.session_state.user.id
         
+        # 似た画像がすでに保存されていないか調べる
+        image_hash, duplicate = None, None
+        if character_image:
+            try:
+                image_hash, duplicate = find_duplicate_image(character_data["user_id"], character_image)
+                character_data.setdefault("character_parameter", {})["image_hash"] = hash_to_hex(image_hash)
+            except Exception as e:
+                st.warning(f"画像の重複チェックに失敗しました: {str(e)}")
 
+        if duplicate:
+            st.warning("⚠️ ほぼ同じ画像がすでに図鑑にあります")
+            if DUPLICATE_IMAGE_POLICY == "block":
+                return False
+            if DUPLICATE_IMAGE_POLICY == "reuse":
+                # 保存済みの画像を使い、ストレージには上げない
+                character_data["character_img_url"] = duplicate[1]
+                character_image = None
         
         # 画像をストレージにアップロード
         if character_image:
@@ -264,11 +301,14 @@ def save_character_to_db_unified(character_data: dict, character_image: Image =
         
         # データベースに保存
         with st.spinner("📦 データベースに保存中..."):
-            response = supabase.table('user_operations').insert(character_data).execute()
+            response = run_sync(get_async_supabase().table('user_operations').insert(character_data).execute(), timeout=15)
         
         
         if response.data:
-            
+            # 次の保存からこの画像とも比べる
+            if image_hash is not None:
+                image_index.add(image_hash, character_data["user_id"],
+                                (response.data[0].get("id"), character_data.get("character_img_url")))
             return True
         else:
             st.error("キャラクター保存に失敗しました")
@@ -280,276 +320,183 @@ def save_character_to_db_unified(character_data: dict, character_image: Image =
         st.error(f"キャラクター保存エラー: {str(e)}")
         return False
 
-#図鑑で表示する関数
-def get_user_characters_unified():
+# 図鑑の1ページに表示する数と並び順
+ZUKAN_PAGE_SIZE = 12
+ZUKAN_SORTS = {
+    "新しい順": ("created_at", True),
+    "古い順": ("created_at", False),
+    "名前順": ("character_name", False),
+    "戦闘力順": ("character_parameter->combat_power", True),
+}
+# 一覧（サムネイル）で取得する列。詳細は選んだキャラだけ取得する
+# thumbnail_url は backfill.py thumbnail で作ったサムネイル（あればそのまま使う）
+ZUKAN_LIST_COLUMNS = "id, character_name, item_name, character_img_url, thumbnail_url:character_parameter->>thumbnail_url"
+
+
+#図鑑の一覧を取得する関数（絞り込み・並び替え・ページングはSupabase側で行う）
+def query_user_characters(search: str = "", maker: str = "", region: str = "", min_combat_power: int = 0,
+                          sort: str = "新しい順", page: int = 0, page_size: int = ZUKAN_PAGE_SIZE):
     """
-    完全統一版：Auth UIDで直接キャラクター一覧を取得
+    ログイン中のユーザーのキャラクターを1ページ分だけ取得する。
+    (キャラクターのリスト, 条件に合う総数) を返す。
     """
     if 'user' not in st.session_state or not st.session_state.user:
-        return []
-    
+        return [], 0
+
     try:
-        auth_user_id = st.session_state.user.id
-        response = supabase.table('user_operations').select('*').eq('user_id', auth_user_id).order('created_at', desc=True).execute()
-        return response.data if response.data else []
-        
+        query = (
+            get_async_supabase().table('user_operations')
+            .select(ZUKAN_LIST_COLUMNS, count='exact')
+            .eq('user_id', st.session_state.user.id)
+        )
+        # PostgRESTのフィルター構文を壊す文字は取り除く
+        search = re.sub(r'[,()*%]', '', search or '').strip()
+        if search:
+            query = query.or_(f"character_name.ilike.*{search}*,item_name.ilike.*{search}*")
+        maker = re.sub(r'[,()*%]', '', maker or '').strip()
+        if maker:
+            query = query.ilike('character_parameter->>maker', f"%{maker}%")
+        if region:
+            query = query.eq('character_parameter->>region', region)
+        if min_combat_power:
+            query = query.gte('character_parameter->combat_power', min_combat_power)
+
+        column, desc = ZUKAN_SORTS.get(sort, ZUKAN_SORTS["新しい順"])
+        start = page * page_size
+        # 値のない行（戦闘力をまだ保存していない古い行など）は最後に回す（Postgresの降順は NULL が先頭になる）
+        query = query.order(column, desc=desc, nullsfirst=False)
+        response = run_sync(query.range(start, start + page_size - 1).execute(), timeout=15)
+        return response.data or [], response.count or 0
+
     except Exception as e:
         st.error(f"キャラクター取得エラー: {str(e)}")
-        return []
-
-
-# 画像生成する関数stabilityai
-def generate_character_image_stability(product_json):
-    # 1. 商品情報取得
+        return [], 0
 
-    # === 戦闘力の計算 ===
-    jan_code = str(product_json.get("codeNumber", "")).strip()
-    combat_power = combat_power_from_jan(jan_code)
 
-    # 2. OpenAIでプロンプト生成
-    region = st.session_state.todoufuken
-    if not region:
-        st.error("都道府県を選択してください")
-        return  None, None, None, None, None
-
-    prompt_for_gpt = f"""
-    以下の商品情報をもとに、アニメ風キャラクターをStable Diffusionで生成するための
-    使える英語のテキストプロンプトを作成してください。
-    
-    キャラクターは商品「{product_json['itemName']}」を擬人化したもので、
-    地域「{region}」のイメージを反映させます。
-    
-    キャラクターはデフォルメ強めのコミカルな「ちびキャラ（SDキャラ）」風で、
-    レトロなカードバトルゲーム風イラストとして表現してください。
-    太めのアウトライン、カラフルで派手な色彩、能力値や属性を感じさせる雰囲気を持たせてください。
-    
-    以下の要素を必ず英語プロンプトに含めてください：
-    - **性格**：キャラクターの性格を具体的に描写（例：勇敢で元気、清潔感がある、戦闘好きなど）
-    - **服装**：RPGキャラクター風の衣装。商品名を連想させるデザインを取り入れる
-    - **小物・持ち物**：商品名をモチーフにしたデフォルメ武器・防具を装備
-    - **姿勢**：戦闘ポーズ（カードバトルゲーム風の構え）
-    - **背景**：地域の特徴（自然や建物など）を取り入れた、カードゲーム用イラスト風背景
-    - **演出**：戦闘力や特殊技を発動しそうなエフェクト（光、オーラ、数字的な力を感じさせる演出）
-    
-    また、このキャラクターに合う短く覚えやすいキャラクター名も作成してください。
-    キャラクター名はカタカナで8文字以内でお願いします。
-    
-    
-    商品情報：
-    - 商品名: {product_json['itemName']}
-    - メーカー: {product_json['makerName']}
-    - 商品画像URL: {product_json['itemImageUrl']}
-    
-    ※結果は以下の形式で出力してください：
-    Prompt: <ここに英語のプロンプト>
-    Character Name: <ここにキャラクター名>
-    """
-    
+#図鑑で選んだキャラクターの詳細を取得する関数
+def get_user_character_detail(character_id):
     try:
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "あなたはアニメ風キャラクター化用プロンプト作成の専門家です。"},
-                {"role": "user", "content": prompt_for_gpt + "\n\n必ず以下の形式で出力してください:\nPrompt: <英語のプロンプト>\nCharacter Name: <カタカナ8文字以内>"}
-            ],
-            max_tokens=200
+        query = (
+            get_async_supabase().table('user_operations').select('*')
+            .eq('user_id', st.session_state.user.id).eq('id', character_id)
+            .limit(1)
         )
-
-        generated_text = response.choices[0].message.content.strip()
-        
-        
-        lines = generated_text.splitlines()
-        sd_prompt = ""
-        character_name = ""
-        collecting_prompt = False
-        
-        for line in lines:
-            line = line.strip()
-            lower_line = line.lower()
-            
-            if lower_line.startswith("prompt:"):
-                # Prompt: の行から収集開始
-                sd_prompt = line.split(":", 1)[1].strip()
-                collecting_prompt = True
-            elif lower_line.startswith("character name:"):
-                character_name = line.split(":", 1)[1].strip()
-                collecting_prompt = False
-            elif "name:" in lower_line and not character_name:
-                # より柔軟なキャラクター名抽出
-                character_name = line.split(":", 1)[1].strip()
-                collecting_prompt = False
-            elif collecting_prompt and line:
-                # Prompt: の続き（改行で複数行ある場合）
-                sd_prompt += " " + line
-        
-        # キャラクター名が見つからない場合、デフォルト名を生成
-        if not character_name:
-            character_name = f"キャラ{random.randint(1000, 9999)}"    
-
-        if not sd_prompt:
-            st.error("OpenAIでプロンプト生成に失敗しました")
-            return None, None, None
-
-        # 3. Stability AIで画像生成
-        stability_prompt = f"""{sd_prompt}"""
-        response = requests.post(
-            f"{stability_api_host}/v1/generation/{engine_id}/text-to-image",
-            headers={
-                "Content-Type": "application/json",
-                "Accept": "application/json",
-                "Authorization": f"Bearer {stability_api_key}"
-            },
-            json={
-                 "style_preset": "anime",
-                "text_prompts": [
-                {
-                    "text": f"{stability_prompt}"
-                }
-            ],
-                "cfg_scale": 7,
-                "height": 1024,
-                "width": 1024,
-                "samples": 1,
-                "steps": 30,
-            },
-        )
-
-        if response.status_code != 200:
-            st.error(f"APIエラーが発生しました。ステータスコード: {response.status_code}\n内容: {response.text}")
-            return None, None, None
-        
-        #キャラ出力
-        data = response.json()
-        image_base64 = data["artifacts"][0]["base64"]
-        image_bytes = base64.b64decode(image_base64)
-        image = Image.open(BytesIO(image_bytes))
-        
-        # セッション状態に保存
-        st.session_state.generated_character = {
-            'prompt': sd_prompt,
-            'name': character_name,
-            'image': image,
-            'barcode': product_json['codeNumber'],
-            'item_name': product_json['itemName'],
-            'region': region,
-            'combat_power': combat_power,
-        }
-        
-        # 表示は呼び出し元で行う
-        return sd_prompt, character_name, image, combat_power
+        response = run_sync(query.execute(), timeout=15)
+        return response.data[0] if response.data else None
     except Exception as e:
-        st.error(f"キャラクター生成エラー: {str(e)}")
-        return None, None, None, None
+        st.error(f"キャラクター取得エラー: {str(e)}")
+        return None
 
 
+@st.cache_data(ttl=24 * 60 * 60, max_entries=2000, show_spinner=False)
+def resized_character_image(url: str, width: int) -> bytes:
+    """画像変換が使えないときのリサイズプロキシ（縮小結果はサーバー側でキャッシュ）"""
+    return resize_image_from_url(url, width)
 
-# 画像生成する関数OPENAI
-def generate_character_image_openai(product_json):
-    # === 戦闘力の計算 ===
-    jan_code = str(product_json.get("codeNumber", "")).strip()
-    combat_power = combat_power_from_jan(jan_code)
 
-    region = st.session_state.todoufuken
-    if not region:
-        st.error("都道府県を選択してください")
-        return None, None, None
+#図鑑で画像を表示するときのソースを返す関数
+def character_image_source(url: str, width: int):
+    """
+    縮小した画像のソースを返す。Supabaseの画像変換が使えればそのURL（CDN・ブラウザでキャッシュされる）、
+    使えなければサーバー側で縮小したバイト列。どちらも失敗したら元のURL。
+    """
+    if not url:
+        return None
+    return transformed_url(url, width) or _resized_or_original(url, width)
 
-    # 1. キャラクター名を生成（テキストモデル）
+
+def _resized_or_original(url: str, width: int):
     try:
-        name_prompt = f"""
-        次の商品をモチーフにしたキャラクターを考えてください。
-        商品名: {product_json['itemName']}
-        メーカー: {product_json['makerName']}
-        商品画像URL: {product_json['itemImageUrl']}
-
-
-        条件:
-        - キャラクターに合う短く覚えやすい名前
-        - カタカナで8文字以内
-        - 出力は次の形式にしてください
-        Character Name: <ここにキャラクター名>
-        """
-        name_response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": name_prompt}],
-            max_tokens=20
-        )
-        character_name_text = name_response.choices[0].message.content.strip()
+        return resized_character_image(url, width)
+    except Exception:
+        return url
 
-        # Character Name: の部分を抽出
-        if "Character Name:" in character_name_text:
-            character_name = character_name_text.split(":", 1)[1].strip()
-        else:
-            character_name = f"キャラ{random.randint(1000,9999)}"
 
-    except Exception as e:
-        st.warning(f"キャラクター名生成に失敗しました: {str(e)}")
-        character_name = f"キャラ{random.randint(1000,9999)}"
-
-    # 2. 画像生成プロンプト
-    sd_prompt = f"""
-    商品「{product_json['itemName']}」情報をもとに、バーコードバトラー風に擬人化したキャラクターを描いてください。
-    キャラクター名は「{character_name}」です。
-    キャラクターはレトロなカードバトルゲーム風イラストとして表現してください。
-    キャラクターには商品画像（ {product_json['itemImageUrl']} ）のイメージを反映させてください。
-
-    以下の要素を必ず含めてください：
-    - **性格**：キャラクターの性格を具体的に描写（例：勇敢で元気、清潔感がある、戦闘好きなど）
-    - **服装**：RPGキャラクター風の衣装。商品名を連想させるデザインを取り入れる
-    - **小物・持ち物**：商品名をモチーフにしたデフォルメ武器・防具を装備
-    - **姿勢**：カードバトルゲーム風の構え
-    - **背景**：{region} の特徴（自然や建物、雰囲気など）を取り入れた、カードゲーム用イラスト風背景。
-    - **演出**：戦闘力や特殊技を発動しそうなエフェクト（光、オーラ、数字的な力を感じさせる演出）
-    - **出力画像**：画像は1024x1024の正方形になるようにしてください。
-    """
+# キャラクター生成ジョブを開始する関数
+def style_for_model_type(model_type):
+    return STYLE_OPENAI if model_type == "レトロで企業らしい雰囲気" else STYLE_STABILITY
 
-    # 3. 画像生成（OpenAI Image API）
-    try:
-        image_response = client.images.generate(
-            model="gpt-image-1",
-            prompt=sd_prompt,
-            size="1024x1024"
-        )
 
-        image_base64 = image_response.data[0].b64_json
-        image_bytes = base64.b64decode(image_base64)
-        image = Image.open(BytesIO(image_bytes))
+def start_generation_job(jan, product_json, region, model_type):
+    """
+    生成ジョブを開始する。同じ (JAN, 地域, スタイル) が実行中ならそのジョブに合流する。
+    ジョブのIDをセッションに持たせ、再実行されても同じジョブに戻れるようにする。
+    """
+    style = style_for_model_type(model_type)
+    key = job_registry.make_key(jan, region, style)
+    generate = generate_with_openai if style == STYLE_OPENAI else generate_with_stability
+    job = job_registry.submit(key, generate, product_json, region, get_services(), subscriber=get_session_id())
+    st.session_state.generation_job_id = job.id
+    return job
+
+
+def pending_generation_job():
+    """このセッションが待っている（まだ結果を保存していない）生成ジョブ。なければ None。"""
+    job_id = st.session_state.get("generation_job_id")
+    job = job_registry.get(job_id) if job_id else None
+    if job is None or not job.unread_by(get_session_id()):
+        st.session_state.pop("generation_job_id", None)
+        return None
+    return job
+
 
-        # セッション状態に保存
-        st.session_state.generated_character = {
-            'prompt': sd_prompt,
-            'name': character_name,
-            'image': image,
-            'barcode': product_json['codeNumber'],
-            'item_name': product_json['itemName'],
-            'region': region,
-            'combat_power': combat_power,
-        }
+# 生成ジョブの完了を待つ関数
+def await_generation_job(job):
+    """進捗を表示しながらジョブの完了を待ち、成功したらセッションに保存する"""
+    with st.status("キャラクターを生成中...", expanded=True) as status:
+        on_progress = progress_renderer(status)
+        on_progress("lookup", {})
+        try:
+            character = wait_for_job(job, on_progress)
+        except Exception as e:
+            status.update(label="生成に失敗しました", state="error")
+            st.error(f"キャラクター生成エラー: {str(e)}")
+            character = None
+        else:
+            status.update(label="🎉 キャラクターが完成しました", state="complete", expanded=False)
 
-        return sd_prompt, character_name, image, combat_power
+    if character:
+        st.session_state.character_generated = True
+        st.session_state.generated_character = store_generated_image(character)
+    # セッションに保存してから、IDを外して結果を手放す
+    # （途中で再実行された場合はここに来ないので、戻ったときにもう一度受け取れる）
+    st.session_state.pop("generation_job_id", None)
+    job.mark_read(get_session_id())
+    return character
 
-    except Exception as e:
-        st.error(f"キャラクター生成エラー: {str(e)}")
-        return None, None, None
 
+def progress_renderer(status):
+    """
+    生成の進捗を st.status の中に順に表示するコールバックを返す。
+    GPTのストリーミング中のテキストは同じ場所を上書きしていく。
+    """
+    text_area = status.empty()
 
+    def on_progress(stage, detail):
+        if stage == "text":
+            text_area.code(detail["text"], language="json")
+        elif stage == "warning":
+            status.warning(detail["message"])
+        elif stage in STAGES:
+            text_area.empty()
+            status.write(STAGES[stage])
+            status.update(label=STAGES[stage])
 
-# メイン画面に戻る関数
-def go_to(page_name):
-    st.session_state.page = page_name
-    st.rerun()    
+    return on_progress
 
 
 # ログイン画面
 def sign_up(email, password):
-    return supabase.auth.sign_up({"email": email, "password": password})
+    return get_supabase().auth.sign_up({"email": email, "password": password})
 
 def sign_in(email, password):
-    return supabase.auth.sign_in_with_password({"email": email, "password": password})
+    return get_supabase().auth.sign_in_with_password({"email": email, "password": password})
 
 def sign_out():
-    supabase.auth.sign_out()
-    st.session_state.clear()
+    try:
+        get_supabase().auth.sign_out()
+    finally:
+        st.session_state.clear()
 
 
 def login_signup_page():
@@ -566,15 +513,12 @@ def login_signup_page():
                 if user :
                     st.session_state.user = user
                     
-                    # プロフィール取得（完全統一版）
-                    profile = get_user_profile_unified(user.id)
-                    if profile:
-                        st.session_state.user_profile = profile
-                        st.session_state.full_name = profile.get("user_name", user.email)
-                        st.success("ログインに成功しました")
-                        st.rerun()
-                    else:
-                        st.error("プロフィールが見つかりません。新規登録が必要かもしれません。")
+                    # プロフィールはログイン結果（user_metadata）から作ってセッションに持つ（追加の問い合わせなし）
+                    profile = profile_from_auth_user(user)
+                    st.session_state.user_profile = profile
+                    st.session_state.full_name = profile["user_name"]
+                    st.success("ログインに成功しました")
+                    st.rerun()
                 else:
                     st.error("userを取得できずにログインに失敗しました")
             except Exception as e:
@@ -589,7 +533,7 @@ def login_signup_page():
         new_name = st.text_input("名前（任意）",key="signup_name")
         if st.button("会員登録をする",type="primary"):
             try:
-                response = supabase.auth.sign_up({
+                response = get_supabase().auth.sign_up({
                     "email": new_email,
                     "password": new_password,
                     "options": {
@@ -600,13 +544,9 @@ def login_signup_page():
                 })
                 
                 if response.user:
-                    # 完全統一版プロフィール作成
-                    profile = create_user_profile_unified(response.user.id, new_email, new_name)
-                    if profile:
-                        st.success("アカウントとプロフィールが作成されました。ログインしてください。")
-                        st.info("✨ ログインして早速始めましょう！")
-                    else:
-                        st.error("プロフィール作成に失敗しました。")
+                    # プロフィール（users テーブルの行）はDBのトリガーが作成する
+                    st.success("アカウントとプロフィールが作成されました。ログインしてください。")
+                    st.info("✨ ログインして早速始めましょう！")
                 else:
                     st.success("アカウントが作成されました。メールを確認してください。")
 
@@ -621,6 +561,52 @@ def login_signup_page():
                 else:
                     st.error(f"その他のエラー: {message}")
 
+# セッションのメモリ管理で使う関数
+
+
+def get_session_id() -> str:
+    if "session_id" not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
+    return st.session_state.session_id
+
+
+def track_session_memory():
+    """毎回の実行で、このセッションの session_state のサイズを記録する（古いセッションの掃除もここで行う）"""
+    state = {k: v for k, v in st.session_state.items() if k not in ("supabase_client", "async_supabase")}
+    user = getattr(st.session_state.get("user"), "email", "") or ""
+    session_memory.touch(get_session_id(), estimate_size(state), user)
+
+
+def store_generated_image(character: dict) -> dict:
+    """生成画像は共有ストアに入れ、セッションにはキーだけを持たせる"""
+    character = dict(character)
+    image = character.pop("image", None)
+    if image is not None:
+        # 事前生成のプールからはPNGのバイト列のまま来る
+        if not isinstance(image, bytes):
+            buffer = io.BytesIO()
+            image.save(buffer, format="PNG")
+            image = buffer.getvalue()
+        old_key = (st.session_state.get("generated_character") or {}).get("image_key")
+        if old_key:
+            blob_store.delete(old_key)
+        character["image_key"] = blob_store.put(get_session_id(), image)
+    return character
+
+
+def clear_generated_character():
+    key = (st.session_state.get("generated_character") or {}).get("image_key")
+    if key:
+        blob_store.delete(key)
+    st.session_state.character_generated = False
+    st.session_state.generated_character = None
+
+
+def is_admin() -> bool:
+    admins = [e.strip() for e in os.getenv("ADMIN_EMAILS", "").split(",") if e.strip()]
+    return getattr(st.session_state.get("user"), "email", None) in admins
+
+
 #メイン画面
 
 def main_app():
@@ -638,6 +624,8 @@ def main_app():
     if "characters" not in st.session_state:
         st.session_state.characters = []
 
+    track_session_memory()
+
     # --- メイン画面 ---
     if st.session_state.page == "main":
         st.title("バーコードバトラー 〜Tech0 Edition〜")
@@ -652,7 +640,10 @@ def main_app():
             if st.button("📖 キャラ図鑑", key="zukan_btn", use_container_width=True):
                 go_to("zukan")
         st.markdown("---")
+        if is_admin() and st.button("🛠️ 管理画面（メモリ使用量）"):
+            go_to("admin")
         if st.button("↩️ ログアウト"):
+            session_memory.forget(get_session_id())
             sign_out()
             st.rerun()
                 
@@ -677,50 +668,12 @@ def main_app():
     elif st.session_state.page == "scan":
                 
         st.title("🎨 キャラ生成")
-        img_file = st.camera_input("JANコードを撮影してください")
-
-        digits, result = None, None
-        if img_file:
-            # アップロードした画像を Pillow で読み込む
-            img = Image.open(io.BytesIO(img_file.getvalue()))
-        
-            #pyzbar でデコード
-            results = decode(img)
-        
-            if results:
-                # 複数バーコードがある場合は最初のものを使う
-                result = results[0]
-                digits = result.data.decode("utf-8")
-                st.success(f"読み取ったコード: {digits} (種類: {result.type})")
-            else:
-                st.warning("バーコードの読み取りに失敗しました")
 
-
-        # 数字入力
-        col1, col2 = st.columns([3,1])
-        with col1:
-            digits_input = st.text_input(
-                "数字を入力（読み取ったコードがあれば自動入力されます）",
-                value=digits or ""
-            )
-        with col2:
-            st.write("")  # 縦位置調整
-            st.write("") 
-            st.write("✅ 手入力OK")
+        # バーコード読み取り・数字入力（appfrontui と共通）
+        digits_input, _ = scan_code_input()
 
         # 都道府県選択
-        prefectures = [
-            "北海道","青森県","岩手県","宮城県","秋田県","山形県","福島県",
-            "茨城県","栃木県","群馬県","埼玉県","千葉県","東京都","神奈川県",
-            "新潟県","富山県","石川県","福井県","山梨県","長野県",
-            "岐阜県","静岡県","愛知県","三重県",
-            "滋賀県","京都府","大阪府","兵庫県","奈良県","和歌山県",
-            "鳥取県","島根県","岡山県","広島県","山口県",
-            "徳島県","香川県","愛媛県","高知県",
-            "福岡県","佐賀県","長崎県","熊本県","大分県","宮崎県","鹿児島県",
-            "沖縄県"
-        ]
-        selected_pref = st.selectbox("都道府県を選択", prefectures, index=12 ,key="todoufuken")
+        selected_pref = select_prefecture()
 
         # モデルの種類選択フォームを追加
         model_type = st.selectbox(
@@ -737,11 +690,35 @@ def main_app():
             # 生成ボタン
             if st.button("✨ 生成する", use_container_width=True):
                 # 1) 入力からJAN取得（カメラで読めた digits があれば digits_input に入っている想定）
-                jan = (digits_input or "").strip().replace(" ", "").replace("　", "")
+                jan = normalize_jan(digits_input)
                 if not jan:
-                    st.error("JANコードを入力（またはスキャン）してください。")
+                    if not (digits_input or "").strip():
+                        st.error("JANコードを入力（またはスキャン）してください。")
+                    else:
+                        st.error(explain_invalid(digits_input))
                     st.stop()
 
+                # 二度押しなどで、このセッションの同じ生成がまだ保存されていなければ、新しく始めずにそれに戻る
+                region = st.session_state.todoufuken
+                pending = pending_generation_job()
+                if pending and pending.key == job_registry.make_key(jan, region, style_for_model_type(model_type)):
+                    if await_generation_job(pending):
+                        st.rerun()
+                    st.stop()
+                if pending:
+                    # 別の条件で生成し直すので、前のジョブの結果は受け取らない
+                    pending.mark_read(get_session_id())
+                    st.session_state.pop("generation_job_id", None)
+
+                # 事前生成のプール（イベント用）にあれば、商品検索も生成もせずにそこから出す
+                pooled = prewarm_pool.take(jan, region, style_for_model_type(model_type))
+                if pooled:
+                    st.session_state["last_product_json"] = {k: pooled.pop("product").get(k, "") for k in PRODUCT_FIELDS}
+                    st.session_state.character_generated = True
+                    st.session_state.generated_character = store_generated_image(pooled)
+                    st.toast(STAGES["image"])
+                    st.rerun()
+
                  # 2) APIで商品検索
                 try:
                     with st.spinner("JANコードを確認中..."):
@@ -780,29 +757,21 @@ def main_app():
                     st.stop()  # ここで処理を止める（以降の生成処理には進まない）
 
                 # 4) セッションに保存（以後の画面遷移でも使えるように）
-                st.session_state["last_product_json"] = product_json
+                st.session_state["last_product_json"] = {k: product_json.get(k, "") for k in PRODUCT_FIELDS}
                 st.success(f"🎉 JANコードの読み込み完了！")
 
-                # 5) モデル種類によって関数を切り替え
-                with st.spinner("キャラクターを生成中..."):
-                    if model_type == "レトロで企業らしい雰囲気":
-                        prompt, name, image,combat_power = generate_character_image_openai(product_json)
-                    else:
-                        prompt, name, image,combat_power = generate_character_image_stability(product_json)
-                
-                if prompt and name and image:
-                    st.session_state.character_generated = True
-                    st.session_state.generated_character = {
-                        "name": name,
-                        "image": image,
-                        "prompt": prompt,
-                        "region": st.session_state.todoufuken,
-                        "barcode": st.session_state["last_product_json"]["codeNumber"],
-                        "item_name": st.session_state["last_product_json"]["itemName"],
-                        "combat_power": combat_power,  # ← ここに保存
-            }
-                    
-                
+                # 5) 生成ジョブを開始（実行中の同じ生成があれば合流）して完了を待つ
+                if not region:
+                    st.error("都道府県を選択してください")
+                    st.stop()
+                job = start_generation_job(jan, product_json, region, model_type)
+                await_generation_job(job)
+
+            elif st.session_state.get("generation_job_id"):
+                # 生成中・保存前に再実行された場合は、新しく始めずにそのジョブに戻る
+                job = pending_generation_job()
+                if job:
+                    await_generation_job(job)
 
             # キャラクターが生成済みの場合、表示と保存ボタンを表示
             if st.session_state.get('character_generated') and st.session_state.get('generated_character'):
@@ -812,7 +781,13 @@ def main_app():
                 cp = st.session_state.get("generated_character", {}).get("combat_power")
                 if cp is not None:
                     st.markdown(f'''名前： :blue[{character_info.get('name', '名前不明')}] 　（戦闘力：{cp}）''')
-                st.image(character_info['image'], use_container_width=True)
+                image_bytes = blob_store.get(character_info.get('image_key'))
+                if image_bytes is None:
+                    # しばらく操作がなかったなどで画像が追い出された
+                    st.warning("画像の保存期限が切れました。もう一度生成してください。")
+                    clear_generated_character()
+                    st.stop()
+                st.image(image_bytes, use_container_width=True)
 
                 with st.expander("🔍 キャラ詳細"):
                     st.write(f"**名前**: {character_info.get('name', '名前不明')}")
@@ -842,6 +817,10 @@ def main_app():
                             "character_parameter": {
                                 "prompt": character_info['prompt'],
                                 "region": character_info['region'],
+                                "maker": st.session_state['last_product_json'].get('makerName', ''),
+                                # 画面に出した戦闘力をそのまま保存する（図鑑の絞り込み・並び替えに使う）
+                                "combat_power": character_info['combat_power'],
+                                # 以下は対戦用のステータス
                                 "power": random.randint(50, 100),
                                 "attack": random.randint(30, 90),
                                 "defense": random.randint(20, 80),
@@ -850,29 +829,24 @@ def main_app():
                         }
                         
                         # 画像も一緒に保存
-                        character_image = character_info['image']
+                        character_image = image_bytes
                         
                         if save_character_to_db_unified(character_data, character_image):
                             # セッション状態の文字配列にも追加（表示用）
-                            st.session_state.characters.append({
-                                'name': character_info['name'],
-                                'barcode': character_info['barcode'],
-                                'type': 'JAN',
-                                'region': character_info['region'],
-                                'power': character_data['character_parameter']['power']
-                            })
+                            remember_character(make_character(
+                                character_info['name'], character_info['barcode'], character_info['region']
+                            ))
+                            st.toast(STAGES["saved"])
                             st.success("🎉 キャラクターを図鑑に保存しました！")
                             
                             # 生成フラグをリセット
-                            st.session_state.character_generated = False
-                            st.session_state.generated_character = None
+                            clear_generated_character()
                             
                 with col_save2:
                     if st.button("🚫 保存しない"):
                         st.info("保存をキャンセルしました")
                         # 生成フラグをリセット
-                        st.session_state.character_generated = False
-                        st.session_state.generated_character = None
+                        clear_generated_character()
                         st.rerun()
 
         st.markdown("---")
@@ -885,39 +859,138 @@ def main_app():
     elif st.session_state.page == "zukan":
         st.title("📖 キャラ図鑑")
         
-        # データベースからキャラクター一覧を取得（完全統一版）
-        db_characters = get_user_characters_unified()
-        
+        if "zukan_page" not in st.session_state:
+            st.session_state.zukan_page = 0
+
+        def reset_zukan_page():
+            st.session_state.zukan_page = 0
+            st.session_state.pop("zukan_selected", None)
+
+        # 絞り込み・並び替え（条件はそのままSupabaseのクエリになる）
+        f1, f2, f3, f4, f5 = st.columns([2, 2, 2, 2, 2])
+        with f1:
+            search = st.text_input("🔍 名前・商品名", key="zukan_search", on_change=reset_zukan_page)
+        with f2:
+            maker = st.text_input("🏭 メーカー", key="zukan_maker", on_change=reset_zukan_page)
+        with f3:
+            region = st.selectbox("📍 居住地", ("すべて",) + PREFECTURES, key="zukan_region", on_change=reset_zukan_page)
+        with f4:
+            min_combat_power = st.slider("💪 戦闘力の下限", 0, COMBAT_POWER_MAX, 0, step=100,
+                                         key="zukan_min_combat_power", on_change=reset_zukan_page)
+        with f5:
+            sort = st.selectbox("↕️ 並び順", list(ZUKAN_SORTS), key="zukan_sort", on_change=reset_zukan_page)
+
+        page = st.session_state.zukan_page
+        db_characters, total = query_user_characters(
+            search, maker, "" if region == "すべて" else region, min_combat_power, sort, page
+        )
+
         if db_characters:
-            st.write(f"**登録済みキャラクター数**: {len(db_characters)}体")
-            
-            for idx, char in enumerate(db_characters, start=1):
-                with st.expander(f"{idx}. {char.get('character_name', '無名キャラ')} - {char.get('item_name', '不明アイテム')}"):
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        if char.get('character_img_url'):
-                            try:
-                                st.image(char['character_img_url'], width=200, caption=char.get('character_name', '名前なし'))
-                                st.caption(f"🔗 画像URL: {char['character_img_url'][:50]}...")
-                            except Exception as e:
-                                st.write("🖼️ 画像を表示できませんでした")
-                                st.caption(f"エラー: {str(e)}")
-                                st.caption(f"URL: {char.get('character_img_url', 'なし')}")
+            last_page = max((total - 1) // ZUKAN_PAGE_SIZE, 0)
+            st.write(f"**登録済みキャラクター数**: {total}体（{page + 1} / {last_page + 1} ページ）")
+
+            # サムネイルのグリッド（1ページ分だけ描画する）
+            columns_per_row = 4
+            for row_start in range(0, len(db_characters), columns_per_row):
+                cols = st.columns(columns_per_row)
+                for col, char in zip(cols, db_characters[row_start:row_start + columns_per_row]):
+                    with col:
+                        if char.get('thumbnail_url'):
+                            st.image(char['thumbnail_url'], use_container_width=True)
+                        elif char.get('character_img_url'):
+                            st.image(character_image_source(char['character_img_url'], THUMBNAIL_WIDTH), use_container_width=True)
                         else:
                             st.write("🖼️ 画像なし")
-                    
-                    with col2:
-                        st.write(f"**バーコード**: {char.get('code_number', 'N/A')}")
-                        if char.get('character_parameter'):
-                            params = char['character_parameter']
-                            if isinstance(params, dict):
-                                st.write("**ステータス**:")
-                                for key, value in params.items():
-                                    if key in ['power', 'attack', 'defense', 'speed']:
-                                        st.write(f"- {key}: {value}")
-                        st.write(f"**作成日**: {char.get('created_at', 'N/A')}")
+                        st.caption(f"{char.get('character_name', '無名キャラ')} - {char.get('item_name', '不明アイテム')}")
+                        if st.button("🔍 詳細", key=f"zukan_detail_{char['id']}", use_container_width=True):
+                            st.session_state.zukan_selected = char['id']
+
+            # ページ送り
+            p1, p2, p3 = st.columns([1, 2, 1])
+            with p1:
+                if st.button("⬅️ 前へ", disabled=page <= 0, use_container_width=True):
+                    st.session_state.zukan_page = page - 1
+                    st.session_state.pop("zukan_selected", None)
+                    st.rerun()
+            with p3:
+                if st.button("次へ ➡️", disabled=page >= last_page, use_container_width=True):
+                    st.session_state.zukan_page = page + 1
+                    st.session_state.pop("zukan_selected", None)
+                    st.rerun()
+
+            # 選んだキャラクターだけ詳細を取得して表示
+            selected_id = st.session_state.get("zukan_selected")
+            char = get_user_character_detail(selected_id) if selected_id is not None else None
+            if char:
+                st.markdown("---")
+                st.subheader(f"{char.get('character_name', '無名キャラ')} - {char.get('item_name', '不明アイテム')}")
+                col1, col2 = st.columns(2)
+                with col1:
+                    if char.get('character_img_url'):
+                        st.image(character_image_source(char['character_img_url'], DETAIL_WIDTH), width=300,
+                                 caption=char.get('character_name', '名前なし'))
+                    else:
+                        st.write("🖼️ 画像なし")
+
+                with col2:
+                    st.write(f"**バーコード**: {char.get('code_number', 'N/A')}")
+                    params = char.get('character_parameter')
+                    if isinstance(params, dict):
+                        if params.get('region'):
+                            st.write(f"**居住地**: {params['region']}")
+                        if params.get('maker'):
+                            st.write(f"**所属先**: {params['maker']}")
+                        if params.get('combat_power') is not None:
+                            st.write(f"**戦闘力**: {params['combat_power']}")
+                        st.write("**ステータス**:")
+                        for key, value in params.items():
+                            if key in ['power', 'attack', 'defense', 'speed']:
+                                st.write(f"- {key}: {value}")
+                    st.write(f"**作成日**: {char.get('created_at', 'N/A')}")
+        elif search or maker or region != "すべて" or min_combat_power:
+            st.info("条件に合うキャラクターがいません。")
         else:
             st.info("まだキャラクターがいません。スキャンしてみましょう！")
+
+        # コレクションのエクスポート・インポート（ZIP = 画像 + JSON）
+        with st.expander("📦 図鑑のエクスポート / インポート"):
+            if st.button("📦 ZIPを作成する"):
+                progress_text = st.empty()
+                with st.spinner("ZIPを作成中..."):
+                    st.session_state.pop("export_urls", None)
+                    try:
+                        zip_paths = export_collection(
+                            get_supabase(), st.session_state.user.id,
+                            on_progress=lambda n: progress_text.caption(f"{n}体を書き出しました"),
+                        )
+                        # ZIPはストレージから直接ダウンロードしてもらう（アプリのメモリに載せない）
+                        # 大きな図鑑は複数のZIPに分かれる（1つが数十MBに収まるように）
+                        st.session_state.export_urls = publish_export(get_supabase(), st.session_state.user.id, zip_paths)
+                    except Exception as e:
+                        st.error(f"エクスポートエラー: {str(e)}")
+            export_urls = st.session_state.get("export_urls") or []
+            for number, url in enumerate(export_urls, start=1):
+                label = "⬇️ ZIPをダウンロード" if len(export_urls) == 1 else f"⬇️ ZIPをダウンロード（{number}/{len(export_urls)}）"
+                st.link_button(label, url)
+            if export_urls:
+                st.caption("リンクの有効期限は1時間です。")
+
+            # ZIPはパートごとに取り込める（1つずつ取り込めば、サーバーのメモリに載るのは1パート分）
+            uploaded_zips = st.file_uploader("ZIPからインポート（分かれている場合は1つずつでも取り込めます）",
+                                             type="zip", key="import_zip", accept_multiple_files=True)
+            if uploaded_zips and st.button("📥 インポートする"):
+                progress_text = st.empty()
+                with st.spinner("インポート中..."):
+                    count = 0
+                    try:
+                        for uploaded_zip in uploaded_zips:
+                            count += import_collection(
+                                get_supabase(), st.session_state.user.id, uploaded_zip,
+                                on_progress=lambda n: progress_text.caption(f"{count + n}体を取り込みました"),
+                            )
+                        st.success(f"🎉 {count}体のキャラクターを取り込みました！")
+                    except Exception as e:
+                        st.error(f"インポートエラー: {str(e)}（{count}体は取り込み済みです）")
             
         st.markdown("---")
         if st.button("⬅️ メイン画面へ戻る"):
@@ -925,6 +998,34 @@ def main_app():
 
 
 
+# --- 管理画面（メモリ使用量） ---
+    elif st.session_state.page == "admin" and is_admin():
+        st.title("🛠️ 管理画面")
+
+        report = session_memory.report()
+        total_state_kb = sum(r["state_kb"] for r in report)
+        c1, c2, c3, c4 = st.columns(4)
+        c1.metric("セッション数", len(report))
+        c2.metric("session_state 合計", f"{total_state_kb / 1024:.1f} MB")
+        c3.metric("共有ストア", f"{blob_store.total_bytes / 1024 / 1024:.1f} / {blob_store.max_bytes / 1024 / 1024:.0f} MB")
+        c4.metric("ストアの追い出し回数", blob_store.evictions)
+        retained_jobs, retained_bytes = job_registry.retained()
+        st.caption(f"{session_memory.idle_seconds // 60}分以上操作のないセッションの画像は自動で削除されます。"
+                   f" 生成ジョブ: 実行中 {job_registry.in_flight()} / 開始 {job_registry.started} / 合流 {job_registry.coalesced}"
+                   f" / 未受け取りの結果 {retained_jobs}件 ({retained_bytes / 1024 / 1024:.1f} MB)"
+                   f" 画像の重複索引: {len(image_index)}件 / {image_index.owners()}ユーザー")
+
+        st.dataframe(report, use_container_width=True)
+        if st.button("🧹 操作のないセッションを今すぐ掃除する"):
+            evicted = session_memory.evict_idle()
+            st.success(f"{evicted}件のセッションのデータを削除しました")
+
+        st.markdown("---")
+        if st.button("⬅️ メイン画面へ戻る"):
+            go_to("main")
+
+
+
 #　アプリケーション全体の流れを制御する
 
 #check_auth()はsession_stateにuserと言うキーが登録されているかの確認。
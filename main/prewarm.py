@@ -0,0 +1,334 @@
+#イベント用のキャラクター事前生成（プリウォーム）
+# 店頭イベントなどで読まれるJANが前もって分かっている場合に、商品検索とキャラ生成を
+# 先にまとめて済ませておき、当日は生成APIを呼ばずにプールから出す。
+# - 同時実行数を絞って並列に生成する（--workers）
+# - 1件できるたびにマニフェスト（JSON Lines）へ追記するので、--resume で続きから再開できる
+# - 事前に API 呼び出し回数と費用の目安を出せる（--estimate）
+# - 終わったら件数・スループット・所要時間を表示する
+#
+# 例: python main/prewarm.py event_jans.txt --regions 東京都,神奈川県 --estimate
+#     python main/prewarm.py event_jans.txt --regions 東京都,神奈川県 --variants 3 --workers 8
+#     python main/prewarm.py event_jans.txt --regions all --style openai --resume
+#
+# 当日はアプリを同じ PREWARM_POOL_DIR で起動すると、プールにある (JAN, 地域, スタイル) は
+# 生成せずにプールから出す。同じ組み合わせが複数あれば PREWARM_VARIETY に従って選ぶ。
+#   rotate: 順番に出す（続けて読んだ人に違うキャラが出る） / random: ランダム / first: いつも同じ
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+from catalog import PRODUCT_FIELDS
+from generation import STYLE_OPENAI, STYLE_STABILITY, generate_with_openai, generate_with_stability
+from images import content_hashed_filename
+from jan import normalize_many
+from prefectures import PREFECTURES
+
+POOL_DIR = os.getenv("PREWARM_POOL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "prewarm_pool"))
+MANIFEST_NAME = "manifest.jsonl"
+PREWARM_VARIETY = os.getenv("PREWARM_VARIETY", "rotate")
+
+GENERATORS = {
+    STYLE_STABILITY: generate_with_stability,
+    STYLE_OPENAI: generate_with_openai,
+}
+
+# 1回あたりの費用の目安（USD）。料金が変わったらここを直す。
+COST_PER_CALL = {
+    "chat": 0.0005,        # gpt-3.5-turbo（プロンプト・名前の生成）
+    "stability": 0.009,    # SDXL 1024x1024 / 30 steps
+    "openai_image": 0.042,  # gpt-image-1 1024x1024
+}
+
+
+# === 当日：プールから出す ===
+
+class PrewarmPool:
+    """
+    事前生成したキャラクターのプール。マニフェストが更新されたら読み直す
+    （イベント中に追加で事前生成しても、アプリを再起動しなくてよい）。
+    """
+
+    def __init__(self, pool_dir: str = POOL_DIR, variety: str = PREWARM_VARIETY):
+        self.pool_dir = pool_dir
+        self.variety = variety
+        self.served = 0
+        self._entries = {}  # (jan, region, style) -> [entry, ...]
+        self._turns = {}
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def _reload_if_changed(self):
+        try:
+            mtime = os.stat(os.path.join(self.pool_dir, MANIFEST_NAME)).st_mtime
+        except OSError:
+            self._entries, self._mtime = {}, None
+            return
+        if mtime != self._mtime:
+            self._entries = group_entries(read_manifest(self.pool_dir))
+            self._mtime = mtime
+
+    def _choose(self, key: tuple, entries: list) -> dict:
+        if self.variety == "random":
+            return random.choice(entries)
+        if self.variety == "rotate":
+            turn = self._turns.get(key, 0)
+            self._turns[key] = turn + 1
+            return entries[turn % len(entries)]
+        return entries[0]
+
+    def take(self, jan_code: str, region: str, style: str):
+        """
+        プールにあればキャラクターを返す（generation.py の結果と同じ形。image はPNGのバイト列、
+        product に商品情報が入る）。なければ None。
+        """
+        key = (jan_code, region, style)
+        with self._lock:
+            self._reload_if_changed()
+            entries = self._entries.get(key)
+            if not entries:
+                return None
+            entry = self._choose(key, entries)
+            self.served += 1
+        with open(os.path.join(self.pool_dir, entry["image_file"]), "rb") as f:
+            image_bytes = f.read()
+        return {
+            "prompt": entry["prompt"],
+            "name": entry["name"],
+            "image": image_bytes,
+            "barcode": entry["jan"],
+            "item_name": entry["product"].get("itemName", ""),
+            "region": entry["region"],
+            "combat_power": entry["combat_power"],
+            "product": entry["product"],
+        }
+
+    def __len__(self):
+        with self._lock:
+            self._reload_if_changed()
+            return sum(len(entries) for entries in self._entries.values())
+
+
+def read_manifest(pool_dir: str) -> list:
+    entries = []
+    path = os.path.join(pool_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return entries
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                break  # 書きかけの最終行
+    return entries
+
+
+def group_entries(entries: list) -> dict:
+    grouped = {}
+    for entry in entries:
+        grouped.setdefault((entry["jan"], entry["region"], entry["style"]), []).append(entry)
+    return grouped
+
+
+# プロセス内で共有するプール
+prewarm_pool = PrewarmPool()
+
+
+# === 事前：まとめて生成する ===
+
+class PoolWriter:
+    """画像を保存してからマニフェストに1行追記する（画像のない行は残らない）"""
+
+    def __init__(self, pool_dir: str, resume: bool):
+        self.pool_dir = pool_dir
+        os.makedirs(os.path.join(pool_dir, "images"), exist_ok=True)
+        path = os.path.join(pool_dir, MANIFEST_NAME)
+        if not resume and os.path.exists(path):
+            sys.exit(f"{path} がすでにあります。続きから作るなら --resume を付けてください。")
+        if os.path.exists(path):
+            # 書きかけの最終行は捨てて、その続きから追記する
+            with open(path, "r+b") as f:
+                data = f.read()
+                f.truncate(data.rfind(b"\n") + 1)
+        self.done = {(e["jan"], e["region"], e["style"], e["variant"]) for e in read_manifest(pool_dir)}
+        self._file = open(path, "a", encoding="utf-8")
+
+    def add(self, entry: dict, image_bytes: bytes):
+        entry["image_file"] = content_hashed_filename(f"images/{entry['jan']}", image_bytes)
+        with open(os.path.join(self.pool_dir, entry["image_file"]), "wb") as f:
+            f.write(image_bytes)
+        self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.done.add((entry["jan"], entry["region"], entry["style"], entry["variant"]))
+
+    def close(self):
+        self._file.close()
+
+
+class PrewarmStats:
+    def __init__(self, total: int):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.not_found = 0
+        self.latencies = []
+        self.started_at = time.perf_counter()
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started_at
+
+    def progress(self) -> str:
+        rate = self.done / max(self.elapsed(), 1e-6)
+        return (f"{self.done + self.failed + self.not_found}/{self.total} 件"
+                f"（成功 {self.done} / 失敗 {self.failed} / 商品なし {self.not_found}）"
+                f" {rate * 60:.1f} 件/分")
+
+    def report(self) -> str:
+        latencies = sorted(self.latencies) or [0.0]
+        p50 = latencies[len(latencies) // 2]
+        p90 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.9))]
+        return (f"完了: {self.progress()}\n"
+                f"所要時間 {self.elapsed():.1f} 秒 / 1件あたり p50 {p50:.1f} 秒・p90 {p90:.1f} 秒")
+
+
+def estimate_cost(jans: int, regions: int, variants: int, style: str) -> dict:
+    """API呼び出し回数と費用の目安（バリエーションごとに名前・プロンプトも作り直す）"""
+    items = jans * regions * variants
+    calls = {"lookup": jans, "chat": items}
+    calls["stability" if style == STYLE_STABILITY else "openai_image"] = items
+    cost = sum(COST_PER_CALL.get(name, 0) * count for name, count in calls.items())
+    return {"items": items, "calls": calls, "cost_usd": round(cost, 2)}
+
+
+def read_jan_list(path: str) -> tuple:
+    """1行1件（CSVなら1列目）のJANを読み、(正規化したJANのリスト, 読めなかった行) を返す"""
+    jans, invalid = {}, []
+    with open(path, encoding="utf-8") as f:
+        raws = (line.split(",", 1)[0].strip() for line in f)
+        for raw, jan in normalize_many(raw for raw in raws if raw and not raw.startswith("#")):
+            if jan:
+                jans[jan] = None  # 重複は除き、順番は保つ
+            else:
+                invalid.append(raw)
+    return list(jans), invalid
+
+
+def _png_bytes(image) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+async def _lookup(services, jan_code: str):
+    """ローカルカタログ → jancodelookup の順に商品を探す（画面の lookup_by_code と同じ順番）"""
+    from catalog import catalog
+    products = catalog.search(jan_code, hits=1)
+    if not products:
+        products = await services.lookup_products(jan_code, 1)
+    return products[0] if products else None
+
+
+async def prewarm(services, jans: list, regions: list, style: str, variants: int, workers: int,
+                  writer: PoolWriter, on_progress=None) -> PrewarmStats:
+    todo = [(jan, region, variant)
+            for jan in jans for region in regions for variant in range(variants)
+            if (jan, region, style, variant) not in writer.done]
+    stats = PrewarmStats(len(todo))
+    semaphore = asyncio.Semaphore(workers)
+    lookups = {}  # 同じJANの商品検索は1回だけ
+    generate = GENERATORS[style]
+
+    async def run_one(jan, region, variant):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                if jan not in lookups:
+                    lookups[jan] = asyncio.ensure_future(_lookup(services, jan))
+                product = await lookups[jan]
+                if not product:
+                    stats.not_found += 1
+                    return
+                # 種類ごとに別のキャッシュキーで名前・プロンプトを作る（同時に走る種類どうしで同じ名前にならない）
+                result = await generate(product, region, services, variant=variant)
+                image_bytes = await asyncio.to_thread(_png_bytes, result["image"])
+                writer.add({
+                    "jan": jan,
+                    "region": region,
+                    "style": style,
+                    "variant": variant,
+                    "name": result["name"],
+                    "prompt": result["prompt"],
+                    "combat_power": result["combat_power"],
+                    "product": {k: product.get(k, "") for k in PRODUCT_FIELDS},
+                }, image_bytes)
+                stats.done += 1
+                stats.latencies.append(time.perf_counter() - started)
+            except Exception as e:
+                stats.failed += 1
+                print(f"  失敗 {jan} {region} #{variant}: {e}")
+            finally:
+                if on_progress:
+                    on_progress(stats)
+
+    try:
+        await asyncio.gather(*(run_one(*item) for item in todo))
+    finally:
+        await services.aclose()
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="イベント用のキャラクター事前生成")
+    parser.add_argument("jan_list", help="JANの一覧（1行1件、CSVなら1列目）")
+    parser.add_argument("--regions", required=True, help="都道府県をカンマ区切りで（all で全都道府県）")
+    parser.add_argument("--style", choices=sorted(GENERATORS), default=STYLE_STABILITY)
+    parser.add_argument("--variants", type=int, default=1, help="1つの (JAN, 地域) に作る数（当日のバリエーション用）")
+    parser.add_argument("--workers", type=int, default=8, help="同時に生成する数")
+    parser.add_argument("--pool-dir", default=POOL_DIR)
+    parser.add_argument("--resume", action="store_true", help="作成済みの分は飛ばして続きから作る")
+    parser.add_argument("--estimate", action="store_true", help="API呼び出し回数と費用の目安だけ表示する")
+    args = parser.parse_args(argv)
+
+    jans, invalid = read_jan_list(args.jan_list)
+    for raw in invalid:
+        print(f"  JANとして正しくないので飛ばします: {raw}")
+    if args.regions == "all":
+        regions = list(PREFECTURES)
+    else:
+        regions = [r.strip() for r in args.regions.split(",") if r.strip()]
+
+    estimate = estimate_cost(len(jans), len(regions), args.variants, args.style)
+    print(f"JAN {len(jans)} 件 × 地域 {len(regions)} × {args.variants} 種類 = {estimate['items']} 体")
+    print(f"API呼び出しの目安: {estimate['calls']} / 費用の目安: ${estimate['cost_usd']}")
+    if args.estimate:
+        return 0
+
+    from cli_env import create_services_from_env
+    writer = PoolWriter(args.pool_dir, args.resume)
+    if writer.done:
+        print(f"作成済みの {len(writer.done)} 体は飛ばします")
+    last_print = [0.0]
+
+    def on_progress(stats):
+        if time.perf_counter() - last_print[0] > 5:
+            last_print[0] = time.perf_counter()
+            print(f"  {stats.progress()}")
+
+    try:
+        stats = asyncio.run(prewarm(create_services_from_env(), jans, regions, args.style,
+                                    args.variants, args.workers, writer, on_progress))
+    finally:
+        writer.close()
+    print(stats.report())
+    return 1 if stats.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
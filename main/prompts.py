@@ -0,0 +1,239 @@
+#プロンプト生成まわりをまとめたモジュール
+# - テンプレートは起動時に一度だけ組み立てる（毎回の長い f-string 生成をやめる）
+# - LLMの出力は (JAN, 地域, スタイル) 単位でメモ化する（上限付きLRU + TTL）
+# - 出力はJSONモードで受け取り、スキーマ検証する（パース失敗による再リクエストをなくす）
+
+import json
+import random
+import re
+import textwrap
+import threading
+import time
+from collections import OrderedDict
+from string import Template
+
+
+# === テンプレート（モジュール読み込み時に一度だけ作る） ===
+
+def _compile(text: str) -> Template:
+    """インデントと前後の空白を落としてテンプレート化（トークン節約）"""
+    return Template(textwrap.dedent(text).strip())
+
+
+STABILITY_SYSTEM_MESSAGE = "あなたはアニメ風キャラクター化用プロンプト作成の専門家です。出力はJSONのみで返してください。"
+
+STABILITY_PROMPT_TEMPLATE = _compile("""
+    以下の商品を擬人化したアニメ風キャラクターを、Stable Diffusionで生成するための英語プロンプトを作成してください。
+    地域「$region」のイメージを反映させます。
+    デフォルメ強めのコミカルなちびキャラ（SDキャラ）で、レトロなカードバトルゲーム風イラスト。
+    太めのアウトライン、カラフルで派手な色彩、能力値や属性を感じさせる雰囲気。
+    英語プロンプトに必ず含める要素：
+    - 性格（例：勇敢で元気、清潔感がある、戦闘好き）
+    - 服装：商品名を連想させるRPG風の衣装
+    - 小物：商品名モチーフのデフォルメ武器・防具
+    - 姿勢：カードバトルゲーム風の戦闘ポーズ
+    - 背景：地域の特徴（自然や建物など）を取り入れたカードゲーム用背景
+    - 演出：光、オーラなど戦闘力や特殊技を感じさせるエフェクト
+    キャラクター名はカタカナ8文字以内で、短く覚えやすいものにしてください。
+
+    商品情報：
+    - 商品名: $item_name
+    - メーカー: $maker_name
+    - 商品画像URL: $item_image_url
+
+    出力形式（JSON）：{"prompt": "<英語のプロンプト>", "character_name": "<カタカナ8文字以内>"}
+""")
+
+NAME_PROMPT_TEMPLATE = _compile("""
+    次の商品をモチーフにしたキャラクターの名前を考えてください。
+    商品名: $item_name
+    メーカー: $maker_name
+    商品画像URL: $item_image_url
+
+    条件:
+    - キャラクターに合う短く覚えやすい名前
+    - カタカナで8文字以内
+    出力形式（JSON）：{"character_name": "<ここにキャラクター名>"}
+""")
+
+OPENAI_IMAGE_PROMPT_TEMPLATE = _compile("""
+    商品「$item_name」情報をもとに、バーコードバトラー風に擬人化したキャラクターを描いてください。
+    キャラクター名は「$character_name」です。
+    キャラクターはレトロなカードバトルゲーム風イラストとして表現してください。
+    キャラクターには商品画像（ $item_image_url ）のイメージを反映させてください。
+
+    以下の要素を必ず含めてください：
+    - **性格**：キャラクターの性格を具体的に描写（例：勇敢で元気、清潔感がある、戦闘好きなど）
+    - **服装**：RPGキャラクター風の衣装。商品名を連想させるデザインを取り入れる
+    - **小物・持ち物**：商品名をモチーフにしたデフォルメ武器・防具を装備
+    - **姿勢**：カードバトルゲーム風の構え
+    - **背景**：$region の特徴（自然や建物、雰囲気など）を取り入れた、カードゲーム用イラスト風背景。
+    - **演出**：戦闘力や特殊技を発動しそうなエフェクト（光、オーラ、数字的な力を感じさせる演出）
+    - **出力画像**：画像は1024x1024の正方形になるようにしてください。
+""")
+
+
+def _product_fields(product_json: dict) -> dict:
+    return {
+        "item_name": product_json.get("itemName", ""),
+        "maker_name": product_json.get("makerName", ""),
+        "item_image_url": product_json.get("itemImageUrl", ""),
+    }
+
+
+def build_stability_messages(product_json: dict, region: str) -> list:
+    """Stability用プロンプトを作るためのChatメッセージ"""
+    content = STABILITY_PROMPT_TEMPLATE.substitute(region=region, **_product_fields(product_json))
+    return [
+        {"role": "system", "content": STABILITY_SYSTEM_MESSAGE},
+        {"role": "user", "content": content},
+    ]
+
+
+def build_name_messages(product_json: dict) -> list:
+    """キャラクター名だけを作るためのChatメッセージ"""
+    content = NAME_PROMPT_TEMPLATE.substitute(**_product_fields(product_json))
+    return [{"role": "user", "content": content}]
+
+
+def build_openai_image_prompt(product_json: dict, region: str, character_name: str) -> str:
+    """OpenAI画像生成用のプロンプト"""
+    return OPENAI_IMAGE_PROMPT_TEMPLATE.substitute(
+        region=region, character_name=character_name, **_product_fields(product_json)
+    )
+
+
+# === 構造化出力のパースとスキーマ検証 ===
+
+# フィールド名: (必須か, 最大文字数)
+STABILITY_SCHEMA = {"prompt": (True, 2000), "character_name": (False, 8)}
+NAME_SCHEMA = {"character_name": (True, 8)}
+
+
+class PromptParseError(ValueError):
+    """LLMの出力がスキーマを満たさなかった"""
+
+
+def _parse_legacy_lines(text: str) -> dict:
+    """旧形式（Prompt: / Character Name:）の行パース。JSONモード非対応時の保険。"""
+    result = {}
+    collecting_prompt = False
+    for line in text.splitlines():
+        line = line.strip()
+        lower_line = line.lower()
+        if lower_line.startswith("prompt:"):
+            result["prompt"] = line.split(":", 1)[1].strip()
+            collecting_prompt = True
+        elif "name:" in lower_line and "character_name" not in result:
+            result["character_name"] = line.split(":", 1)[1].strip()
+            collecting_prompt = False
+        elif collecting_prompt and line:
+            result["prompt"] += " " + line
+    return result
+
+
+# "フィールド名": "値（閉じていなくてもよい）
+_JSON_STRING_FIELD = re.compile(r'"(\w+)"\s*:\s*"((?:[^"\\]|\\.)*)')
+
+
+def _parse_truncated_json(text: str) -> dict:
+    """
+    max_tokens で途中で切れたJSONオブジェクトから、文字列のフィールドを拾う。
+    最後のフィールドは途中までの値になる（プロンプトは途中まででも使える）。
+    """
+    result = {}
+    for field, raw in _JSON_STRING_FIELD.findall(text):
+        # 切れ目に残った不完全なエスケープ（\ や \u00）は落とす
+        raw = re.sub(r'\\(u[0-9a-fA-F]{0,3})?$', '', raw)
+        try:
+            result.setdefault(field, json.loads(f'"{raw}"'))
+        except ValueError:
+            continue
+    return result
+
+
+def parse_structured_output(text: str, schema: dict) -> dict:
+    """
+    LLMの出力（JSON）をスキーマに沿って検証して返す。
+    途中で切れたJSONなら読めたところまでを使い、JSONでなければ旧形式の行パースにフォールバックする。
+    必須フィールドが欠けていれば PromptParseError。
+    """
+    text = (text or "").strip()
+    try:
+        data = json.loads(text)
+        if not isinstance(data, dict):
+            raise ValueError("JSON object ではありません")
+    except ValueError:
+        data = _parse_truncated_json(text) if text.startswith("{") else _parse_legacy_lines(text)
+
+    result = {}
+    for field, (required, max_len) in schema.items():
+        value = data.get(field)
+        if isinstance(value, str):
+            value = value.strip().strip('"「」')
+        if not value or not isinstance(value, str):
+            if required:
+                raise PromptParseError(f"{field} がLLMの出力に含まれていません")
+            continue
+        result[field] = value[:max_len]
+    return result
+
+
+def fallback_character_name() -> str:
+    """キャラクター名が取れなかったときのデフォルト名"""
+    return f"キャラ{random.randint(1000, 9999)}"
+
+
+# === LLM出力のメモ化（上限付きLRU + TTL） ===
+
+class LLMOutputCache:
+    """
+    (JAN, 地域, スタイル, 種類) → LLM出力 のキャッシュ。
+    Streamlitの全セッションで共有するのでロックで保護する。
+    """
+
+    def __init__(self, maxsize: int = 512, ttl: float = 24 * 60 * 60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(jan_code: str, region: str, style: str, variant: int = 0) -> tuple:
+        """variant は事前生成で同じ (JAN, 地域, スタイル) を何種類か作るときの番号（画面からは常に0）"""
+        return (str(jan_code), region, style, variant)
+
+    def get(self, key: tuple):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            stored_at, value = entry
+            if time.time() - stored_at > self.ttl:
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return dict(value)
+
+    def put(self, key: tuple, value: dict):
+        with self._lock:
+            self._data[key] = (time.time(), dict(value))
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+# プロセス内で共有するキャッシュ
+llm_output_cache = LLMOutputCache()
@@ -0,0 +1,104 @@
+#スキャン画面の共通部品
+# main/login.py と appfrontui/uitest.py の両方から使う。
+# - 都道府県の選択（表は prefectures.py）
+# - バーコードの読み取り（撮影・ライブスキャン）と入力欄
+# - 画面に残すキャラクター（session_state.characters）の形と、強さの計算（jan.combat_power_from_jan に一本化）
+
+import io
+
+import streamlit as st
+from PIL import Image
+
+from jan import combat_power_from_jan, explain_invalid
+from live_scan import HAS_WEBRTC, decode_jan, live_scan
+from prefectures import PREFECTURES, PREFECTURE_INDEX, DEFAULT_PREFECTURE
+
+# 読み取り方法
+SCAN_MODE_SNAPSHOT = "📸 撮影して読み取る"
+SCAN_MODE_LIVE = "🎥 ライブスキャン"
+SCAN_MODES = (SCAN_MODE_SNAPSHOT,) + ((SCAN_MODE_LIVE,) if HAS_WEBRTC else ())
+
+# 画面に残すキャラクターの最大数
+MAX_SESSION_CHARACTERS = 50
+
+
+# 画面を切り替える関数
+def go_to(page_name):
+    st.session_state.page = page_name
+    st.rerun()
+
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def decode_image_bytes(image_bytes: bytes):
+    """
+    撮影した画像からJANを読む。(コード, 種類) か None を返す。
+    再実行（rerun）のたびに同じ写真をデコードし直さないよう、画像の中身でキャッシュする。
+    """
+    return decode_jan(Image.open(io.BytesIO(image_bytes)))
+
+
+def scan_code_input(key: str = "scan"):
+    """
+    読み取り方法の選択・撮影（またはライブスキャン）・数字の入力欄を表示する。
+    (入力されたコード, 読み取ったバーコードの種類 または None) を返す。
+    """
+    scan_mode = st.radio("読み取り方法", SCAN_MODES, horizontal=True, key=f"{key}_mode")
+
+    digits, symbology = None, None
+    if scan_mode == SCAN_MODE_LIVE:
+        # 映像を流しながら読み取り、JANが読めたら自動入力する
+        scanned = live_scan(key=f"{key}_live")
+        if scanned:
+            digits, symbology, stats = scanned
+            st.success(f"読み取ったコード: {digits} (種類: {symbology})")
+            st.caption(f"⏱️ 読み取りまで {stats['time_to_first_read']:.2f} 秒 / {stats['fps']:.1f} fps")
+    else:
+        img_file = st.camera_input("JANコードを撮影してください", key=f"{key}_camera")
+        if img_file:
+            # pyzbar（と zxingcpp）でデコードし、JANとして正しい最初のものを使う
+            scanned = decode_image_bytes(img_file.getvalue())
+            if scanned:
+                digits, symbology = scanned
+                st.success(f"読み取ったコード: {digits} (種類: {symbology})")
+            else:
+                st.warning("バーコードの読み取りに失敗しました")
+
+    # 数字入力
+    col1, col2 = st.columns([3,1])
+    with col1:
+        digits_input = st.text_input(
+            "数字を入力（読み取ったコードがあれば自動入力されます）",
+            value=digits or ""
+        )
+        # 入力の時点で桁数・チェックディジットを確認（APIは呼ばない）
+        input_error = explain_invalid(digits_input) if (digits_input or "").strip() else ""
+        if input_error:
+            st.caption(f"⚠️ {input_error}")
+    with col2:
+        st.write("")  # 縦位置調整
+        st.write("")
+        st.write("✅ 手入力OK")
+
+    return digits_input, symbology
+
+
+def select_prefecture(key: str = "todoufuken") -> str:
+    return st.selectbox("都道府県を選択", PREFECTURES, index=PREFECTURE_INDEX[DEFAULT_PREFECTURE], key=key)
+
+
+def make_character(name: str, barcode: str, region: str, symbology: str = None) -> dict:
+    """画面に残すキャラクター。戦闘力は JAN から計算する（どの画面でも、図鑑に保存した値とも同じになる）。"""
+    return {
+        "name": name,
+        "barcode": barcode,
+        "type": symbology or "JAN",
+        "region": region,
+        "combat_power": combat_power_from_jan(barcode),
+    }
+
+
+def remember_character(character: dict):
+    """session_state.characters に追加する（表示用なので新しいものだけ残す）"""
+    characters = st.session_state.setdefault("characters", [])
+    characters.append(character)
+    del characters[:-MAX_SESSION_CHARACTERS]
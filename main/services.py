@@ -0,0 +1,173 @@
+#外部APIの非同期サービス層
+# OpenAI（AsyncOpenAI）、Stability AI・jancodelookup（httpx.AsyncClient）への通信を、
+# 全セッションで共有する1つのイベントループ（専用スレッド）の上で動かす。
+# 画面側からは run_sync() で待つだけなので、同時に何百件の通信が飛んでいても
+# スレッドはイベントループの1本で済む。
+#
+# Supabase のデータ（PostgREST・ストレージ）も、セッションごとの非同期クライアントでこのループの上で呼ぶ。
+# クライアントはログインユーザーのアクセストークンをそれぞれ持つので、セッションをまたいで認証が混ざらない。
+# ログイン・トークン更新（auth）は画面側の同期クライアント（login.get_supabase）のまま。
+
+import asyncio
+import base64
+import threading
+from dataclasses import dataclass
+from io import BytesIO
+
+import httpx
+from openai import AsyncOpenAI
+from PIL import Image
+from supabase import AsyncClientOptions, acreate_client
+
+# 同時に張るHTTPコネクションの上限
+MAX_CONNECTIONS = 200
+
+
+@dataclass
+class StabilityConfig:
+    api_host: str
+    api_key: str
+    engine_id: str = "stable-diffusion-xl-1024-v1-0"
+
+
+class UpstreamError(Exception):
+    """外部APIがエラーを返した（画面にそのまま表示できるメッセージを持つ）"""
+
+
+# === 共有イベントループ ===
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """専用スレッドで動くイベントループを返す（初回だけ起動する）"""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="upstream-io", daemon=True)
+            thread.start()
+            _loop = loop
+    return _loop
+
+
+def submit(coro):
+    """コルーチンを共有ループに投げ、concurrent.futures.Future を返す"""
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop())
+
+
+def run_sync(coro, timeout: float = None):
+    """同期コード（Streamlitの画面）から、コルーチンの完了を待って結果を返す"""
+    return submit(coro).result(timeout)
+
+
+def decode_image(image_base64: str) -> Image.Image:
+    image = Image.open(BytesIO(base64.b64decode(image_base64)))
+    image.load()
+    return image
+
+
+async def create_session_supabase(url: str, key: str, access_token: str = None):
+    """
+    ログイン中のユーザーとしてPostgREST・ストレージを呼ぶ非同期クライアントを、共有ループの中で作る。
+    トークンの更新はしない（画面側の同期クライアントが更新したら、新しいトークンで作り直す）。
+    """
+    options = AsyncClientOptions(auto_refresh_token=False, persist_session=False)
+    if access_token:
+        options.headers["Authorization"] = f"Bearer {access_token}"
+    return await acreate_client(url, key, options)
+
+
+# === サービス本体 ===
+
+class UpstreamServices:
+    """
+    外部APIの非同期クライアントをまとめたもの。
+    クライアントは共有ループの中で最初に使うときに作る。
+    """
+
+    def __init__(self, openai_api_key: str, stability: StabilityConfig, jancode_app_id: str, jancode_base: str):
+        self.openai_api_key = openai_api_key
+        self.stability = stability
+        self.jancode_app_id = jancode_app_id
+        self.jancode_base = jancode_base
+        self._http = None
+        self._openai = None
+
+    @property
+    def http(self) -> httpx.AsyncClient:
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                timeout=httpx.Timeout(120, connect=10),
+                limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=50),
+            )
+        return self._http
+
+    @property
+    def openai(self) -> AsyncOpenAI:
+        if self._openai is None:
+            self._openai = AsyncOpenAI(api_key=self.openai_api_key)
+        return self._openai
+
+    async def lookup_products(self, jan_code: str, hits: int = 10) -> list:
+        """jancodelookup の code 検索（前方一致）。商品のリストを返す。"""
+        params = {"appId": self.jancode_app_id, "query": jan_code, "hits": hits, "type": "code"}
+        response = await self.http.get(self.jancode_base, params=params, timeout=10)
+        response.raise_for_status()
+        return response.json().get("product") or []
+
+    async def chat_json(self, messages: list, max_tokens: int, on_text=None) -> str:
+        """
+        ChatをJSONモード＋ストリーミングで呼ぶ。途中経過は on_text(これまでの全文) で通知し、全文を返す。
+        """
+        stream = await self.openai.chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=messages,
+            response_format={"type": "json_object"},
+            max_tokens=max_tokens,
+            stream=True,
+        )
+        parts = []
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                parts.append(delta)
+                if on_text:
+                    on_text("".join(parts))
+        return "".join(parts)
+
+    async def stability_text_to_image(self, prompt: str) -> Image.Image:
+        response = await self.http.post(
+            f"{self.stability.api_host}/v1/generation/{self.stability.engine_id}/text-to-image",
+            headers={
+                "Content-Type": "application/json",
+                "Accept": "application/json",
+                "Authorization": f"Bearer {self.stability.api_key}"
+            },
+            json={
+                "style_preset": "anime",
+                "text_prompts": [{"text": prompt}],
+                "cfg_scale": 7,
+                "height": 1024,
+                "width": 1024,
+                "samples": 1,
+                "steps": 30,
+            },
+        )
+        if response.status_code != 200:
+            raise UpstreamError(f"APIエラーが発生しました。ステータスコード: {response.status_code}\n内容: {response.text}")
+        # デコードはCPU処理なのでループを止めないよう別スレッドで
+        return await asyncio.to_thread(decode_image, response.json()["artifacts"][0]["base64"])
+
+    async def openai_image(self, prompt: str) -> Image.Image:
+        response = await self.openai.images.generate(model="gpt-image-1", prompt=prompt, size="1024x1024")
+        return await asyncio.to_thread(decode_image, response.data[0].b64_json)
+
+    async def aclose(self):
+        if self._http is not None:
+            await self._http.aclose()
+        if self._openai is not None:
+            await self._openai.close()
@@ -0,0 +1,148 @@
+#セッションのメモリ管理
+# 大きなもの（生成画像など）は session_state に直接持たず、全セッション共有の
+# サイズ上限付きLRUストアに入れて、session_state にはキーだけを持たせる。
+# しばらく操作のないセッションの分はストアから消す。
+# 管理画面用に、セッションごと・全体のメモリ使用量を集計する。
+
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+# 共有ストアの上限（バイト）
+BLOB_STORE_MAX_BYTES = int(os.getenv("BLOB_STORE_MAX_MB", "512")) * 1024 * 1024
+# この秒数操作がなければ、そのセッションの大きなデータを消す
+SESSION_IDLE_SECONDS = int(os.getenv("SESSION_IDLE_SECONDS", "1800"))
+# 古いセッションの掃除を行う間隔（秒）
+_EVICT_INTERVAL = 60
+
+
+def estimate_size(obj, _depth: int = 0) -> int:
+    """オブジェクトのおおよそのサイズ（バイト）。辞書・リストは中身もたどる。"""
+    if _depth > 4:
+        return sys.getsizeof(obj)
+    if isinstance(obj, (bytes, bytearray, str)):
+        return sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(
+            estimate_size(k, _depth + 1) + estimate_size(v, _depth + 1) for k, v in obj.items()
+        )
+    if isinstance(obj, (list, tuple, set)):
+        return sys.getsizeof(obj) + sum(estimate_size(v, _depth + 1) for v in obj)
+    # PIL.Image はピクセル分のメモリを持っている
+    if hasattr(obj, "size") and hasattr(obj, "getbands"):
+        width, height = obj.size
+        return width * height * len(obj.getbands())
+    return sys.getsizeof(obj)
+
+
+class BlobStore:
+    """全セッションで共有する、合計サイズ上限付きのLRUストア"""
+
+    def __init__(self, max_bytes: int = BLOB_STORE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.evictions = 0
+        self._data = OrderedDict()  # key -> (session_id, bytes)
+        self._lock = threading.Lock()
+
+    def put(self, session_id: str, data: bytes) -> str:
+        key = uuid.uuid4().hex
+        with self._lock:
+            self._data[key] = (session_id, data)
+            self.total_bytes += len(data)
+            while self.total_bytes > self.max_bytes and len(self._data) > 1:
+                _, (_, old) = self._data.popitem(last=False)
+                self.total_bytes -= len(old)
+                self.evictions += 1
+        return key
+
+    def get(self, key: str):
+        """データを返す。追い出されていれば None。"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            self._data.move_to_end(key)
+            return entry[1]
+
+    def delete(self, key: str):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is not None:
+                self.total_bytes -= len(entry[1])
+
+    def drop_session(self, session_id: str) -> int:
+        """セッションのデータをすべて消し、消したバイト数を返す"""
+        freed = 0
+        with self._lock:
+            for key in [k for k, (owner, _) in self._data.items() if owner == session_id]:
+                freed += len(self._data.pop(key)[1])
+            self.total_bytes -= freed
+        return freed
+
+    def bytes_by_session(self) -> dict:
+        usage = {}
+        with self._lock:
+            for owner, data in self._data.values():
+                usage[owner] = usage.get(owner, 0) + len(data)
+        return usage
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SessionMemory:
+    """セッションごとの最終操作時刻と session_state のサイズを記録する"""
+
+    def __init__(self, store: BlobStore, idle_seconds: int = SESSION_IDLE_SECONDS):
+        self.store = store
+        self.idle_seconds = idle_seconds
+        self._sessions = {}  # session_id -> {"last_seen", "state_bytes", "user"}
+        self._lock = threading.Lock()
+        self._last_evict = time.time()
+
+    def touch(self, session_id: str, state_bytes: int, user: str = ""):
+        with self._lock:
+            self._sessions[session_id] = {"last_seen": time.time(), "state_bytes": state_bytes, "user": user}
+            due = time.time() - self._last_evict > _EVICT_INTERVAL
+        if due:
+            self.evict_idle()
+
+    def forget(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+        self.store.drop_session(session_id)
+
+    def evict_idle(self) -> int:
+        """しばらく操作のないセッションのデータを消す。消したセッション数を返す。"""
+        now = time.time()
+        with self._lock:
+            self._last_evict = now
+            idle = [sid for sid, info in self._sessions.items() if now - info["last_seen"] > self.idle_seconds]
+            for sid in idle:
+                del self._sessions[sid]
+        for sid in idle:
+            self.store.drop_session(sid)
+        return len(idle)
+
+    def report(self) -> list:
+        """管理画面用：セッションごとの使用量（大きい順）"""
+        blob_usage = self.store.bytes_by_session()
+        now = time.time()
+        with self._lock:
+            rows = [{
+                "session": sid[:8],
+                "user": info["user"],
+                "idle_s": int(now - info["last_seen"]),
+                "state_kb": info["state_bytes"] // 1024,
+                "blob_kb": blob_usage.get(sid, 0) // 1024,
+            } for sid, info in self._sessions.items()]
+        return sorted(rows, key=lambda r: r["state_kb"] + r["blob_kb"], reverse=True)
+
+
+# プロセス内で共有するストア
+blob_store = BlobStore()
+session_memory = SessionMemory(blob_store)
@@ -0,0 +1,369 @@
+#トーナメントモード
+# 全プレイヤーの保存済みキャラ（user_operations）でトーナメントを行う。
+# - 対戦の勝敗は保存済みステータスと combat_power_from_jan から決定的に決まる（同じ入力なら同じ結果）
+# - 試合はチャンクにまとめてプロセスプールで並列に解決する
+# - 結果はチャンクごとに JSON Lines に追記するので、途中で落ちても --resume で続きから再開できる
+#
+# 例: python main/tournament.py run weekly-42 --format bracket
+#     python main/tournament.py run weekly-42 --format round-robin --group-size 32 --resume
+#     python main/tournament.py run test --synthetic 5000 --format round-robin
+#     python main/tournament.py bench --synthetic 2000
+
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from jan import check_digit, combat_power_from_jan
+
+# 1回の対戦の最大ターン数
+MAX_TURNS = 20
+# 1タスクで解決する試合数
+CHUNK_SIZE = 2000
+# 使えるコア数
+CPU_COUNT = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+
+# ワーカープロセスで共有する出場者テーブル（initializer で設定）
+_ENTRANTS = {}
+
+
+# === 出場者と対戦の解決 ===
+
+def entrant_from_row(row: dict) -> tuple:
+    """user_operations の行を (id, 名前, power, attack, defense, speed, 戦闘力) にする"""
+    params = row.get("character_parameter") or {}
+    return (
+        row["id"],
+        row.get("character_name") or "無名キャラ",
+        int(params.get("power") or 50),
+        int(params.get("attack") or 50),
+        int(params.get("defense") or 50),
+        int(params.get("speed") or 50),
+        combat_power_from_jan(row.get("code_number", "")),
+    )
+
+
+def resolve_match(a: tuple, b: tuple, seed: str) -> tuple:
+    """
+    2体を戦わせて (勝者id, 敗者id, 勝者の残りHP) を返す。
+    乱数は (seed, 両者のid) から作るので、同じ対戦は何度やっても同じ結果になる。
+    """
+    digest = hashlib.blake2b(f"{seed}:{a[0]}:{b[0]}".encode(), digest_size=8).digest()
+    rng = random.Random(int.from_bytes(digest, "big"))
+
+    # HPは power と戦闘力から
+    hp = {a[0]: 100 + a[2] + a[6] // 100, b[0]: 100 + b[2] + b[6] // 100}
+    # 素早い方が先攻（同じなら乱数）
+    order = [a, b] if (a[5], rng.random()) >= (b[5], 0.5) else [b, a]
+
+    for turn in range(MAX_TURNS):
+        attacker, defender = order[turn % 2], order[(turn + 1) % 2]
+        damage = max(1, int(attacker[3] * rng.uniform(0.8, 1.2) - defender[4] * 0.5))
+        # 戦闘力が高いほど会心が出やすい
+        if rng.random() < attacker[6] / 40000:
+            damage *= 2
+        hp[defender[0]] -= damage
+        if hp[defender[0]] <= 0:
+            return attacker[0], defender[0], hp[attacker[0]]
+
+    # 決着がつかなければ残りHPの割合で判定（同じなら id の小さい方）
+    def ratio(e):
+        return hp[e[0]] / (100 + e[2] + e[6] // 100)
+    winner, loser = sorted((a, b), key=lambda e: (-ratio(e), str(e[0])))
+    return winner[0], loser[0], hp[winner[0]]
+
+
+def _init_worker(entrants: dict):
+    global _ENTRANTS
+    _ENTRANTS = entrants
+
+
+def _resolve_chunk(matches: list, seed: str) -> list:
+    """ワーカーで実行：[(試合id, aのid, bのid), ...] をまとめて解決する"""
+    results = []
+    for match_id, a_id, b_id in matches:
+        winner, loser, hp = resolve_match(_ENTRANTS[a_id], _ENTRANTS[b_id], seed)
+        results.append({"match": match_id, "winner": winner, "loser": loser, "hp": hp})
+    # 書き出す行もワーカーで作っておく（親プロセスを詰まらせない）
+    lines = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in results)
+    return results, lines
+
+
+# === 結果の保存と再開 ===
+
+def entrants_fingerprint(entrants: dict) -> str:
+    """出場者（id とステータス）のハッシュ。再開時に出場者が変わっていないかの確認に使う。"""
+    digest = hashlib.blake2b(digest_size=16)
+    for entrant_id in sorted(entrants, key=str):
+        digest.update(json.dumps(entrants[entrant_id], ensure_ascii=False).encode())
+    return digest.hexdigest()
+
+
+class ResultLog:
+    """
+    試合結果の JSON Lines。書き込むたびに flush + fsync して、落ちても消えないようにする。
+    横に置くメタ情報（<path>.meta.json）に形式と出場者のハッシュを保存し、
+    それが今回と違えば再開しない（組み合わせが変わり、古い結果と混ざるため）。
+    """
+
+    def __init__(self, path: str, resume: bool, meta: dict):
+        self.path = path
+        self.meta_path = path + ".meta.json"
+        self.results = {}
+        if resume and os.path.exists(path):
+            saved = None
+            if os.path.exists(self.meta_path):
+                with open(self.meta_path, encoding="utf-8") as f:
+                    saved = json.load(f)
+            if saved != meta:
+                sys.exit(f"{path} は別の出場者・形式の結果なので再開できません（--resume を外すとやり直します）。")
+            valid_bytes = 0
+            with open(path, "rb") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break  # 書きかけの最終行
+                    self.results[record["match"]] = record
+                    valid_bytes += len(line)
+            # 書きかけの行は捨てて、その続きから追記する
+            with open(path, "r+b") as f:
+                f.truncate(valid_bytes)
+        else:
+            if os.path.exists(path):
+                os.remove(path)
+            with open(self.meta_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def append(self, records: list, lines: str):
+        for record in records:
+            self.results[record["match"]] = record
+        self._file.write(lines)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def _chunks(items, size: int):
+    iterator = iter(items)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def resolve_all(matches, entrants: dict, seed: str, log: ResultLog, workers: int, on_chunk=None) -> int:
+    """未解決の試合だけをプロセスプールで解決し、チャンクごとに保存する。解決した試合数を返す。"""
+    pending = (m for m in matches if m[0] not in log.results)
+    resolved = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(entrants,)) as pool:
+        # 同時に投げるチャンクは workers の2倍まで（メモリを抑える）
+        in_flight = []
+        for chunk in _chunks(pending, CHUNK_SIZE):
+            in_flight.append(pool.submit(_resolve_chunk, chunk, seed))
+            if len(in_flight) >= workers * 2:
+                records, lines = in_flight.pop(0).result()
+                log.append(records, lines)
+                resolved += len(records)
+                if on_chunk:
+                    on_chunk(resolved)
+        for future in in_flight:
+            records, lines = future.result()
+            log.append(records, lines)
+            resolved += len(records)
+            if on_chunk:
+                on_chunk(resolved)
+    return resolved
+
+
+# === 形式ごとの組み合わせ ===
+
+def seeded_order(entrant_ids: list, seed: str) -> list:
+    """シード順（戦闘力とは無関係に seed から決まる並び）"""
+    return sorted(entrant_ids, key=lambda i: hashlib.blake2b(f"{seed}:{i}".encode(), digest_size=8).digest())
+
+
+def round_robin_matches(entrant_ids: list, seed: str, group_size: int):
+    """グループごとの総当たり。group_size=0 なら全員で総当たり。"""
+    ordered = seeded_order(entrant_ids, seed)
+    size = group_size or len(ordered)
+    for g, start in enumerate(range(0, len(ordered), size)):
+        group = ordered[start:start + size]
+        for a, b in itertools.combinations(group, 2):
+            yield (f"g{g}:{a}:{b}", a, b)
+
+
+def run_round_robin(entrants: dict, seed: str, log: ResultLog, workers: int, group_size: int, on_chunk=None) -> list:
+    ids = list(entrants)
+    resolve_all(round_robin_matches(ids, seed, group_size), entrants, seed, log, workers, on_chunk)
+    wins = dict.fromkeys(ids, 0)
+    for record in log.results.values():
+        if record["winner"] in wins and record["loser"] in wins:
+            wins[record["winner"]] += 1
+    return sorted(ids, key=lambda i: (-wins[i], str(i)))
+
+
+def run_bracket(entrants: dict, seed: str, log: ResultLog, workers: int, on_chunk=None) -> list:
+    """シングルエリミネーション。ラウンドごとにまとめて解決する。最後に勝ち残った順に返す。"""
+    alive = seeded_order(list(entrants), seed)
+    eliminated = []
+    round_no = 0
+    while len(alive) > 1:
+        round_no += 1
+        # 奇数のときは最後の1人が不戦勝
+        bye = alive[-1] if len(alive) % 2 else None
+        pairs = [(f"r{round_no}:{alive[i]}:{alive[i + 1]}", alive[i], alive[i + 1]) for i in range(0, len(alive) - 1, 2)]
+        resolve_all(pairs, entrants, seed, log, workers, on_chunk)
+        winners = [log.results[m]["winner"] for m, _, _ in pairs]
+        eliminated = [log.results[m]["loser"] for m, _, _ in pairs] + eliminated
+        alive = winners + ([bye] if bye is not None else [])
+        print(f"ラウンド{round_no}: {len(pairs)} 試合 → 残り {len(alive)} 体")
+    return alive + eliminated
+
+
+# === 出場者の読み込み ===
+
+def load_entrants_from_supabase(chunk_size: int = 1000) -> dict:
+    from cli_env import create_supabase_from_env
+    from keyset import iter_row_chunks
+    supabase = create_supabase_from_env()
+    entrants = {}
+    for rows in iter_row_chunks(supabase, chunk_size, columns="id, character_name, code_number, character_parameter"):
+        for row in rows:
+            entrant = entrant_from_row(row)
+            entrants[entrant[0]] = entrant
+    return entrants
+
+
+def load_entrants_from_file(path: str) -> dict:
+    """collection_io のエクスポートなど、user_operations の行の JSON Lines から読む"""
+    entrants = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                entrant = entrant_from_row(json.loads(line))
+                entrants[entrant[0]] = entrant
+    return entrants
+
+
+def synthetic_entrants(n: int, seed: int = 0) -> dict:
+    """ベンチマーク用のダミー出場者"""
+    rng = random.Random(seed)
+    entrants = {}
+    for i in range(n):
+        body = "49" + "".join(rng.choice("0123456789") for _ in range(10))
+        row = {
+            "id": i,
+            "character_name": f"キャラ{i}",
+            "code_number": body + str(check_digit(body)),
+            "character_parameter": {
+                "power": rng.randint(50, 100), "attack": rng.randint(30, 90),
+                "defense": rng.randint(20, 80), "speed": rng.randint(40, 95),
+            },
+        }
+        entrants[i] = entrant_from_row(row)
+    return entrants
+
+
+# === コマンド ===
+
+def run_tournament(args) -> int:
+    if args.synthetic:
+        entrants = synthetic_entrants(args.synthetic)
+    elif args.entrants:
+        entrants = load_entrants_from_file(args.entrants)
+    else:
+        entrants = load_entrants_from_supabase()
+    print(f"出場者: {len(entrants)} 体")
+
+    meta = {
+        "tournament_id": args.tournament_id,
+        "format": args.format,
+        "group_size": args.group_size if args.format == "round-robin" else None,
+        "entrants": len(entrants),
+        "entrants_hash": entrants_fingerprint(entrants),
+    }
+    log = ResultLog(args.results or f"tournament_{args.tournament_id}.results.jsonl", args.resume, meta)
+    if log.results:
+        print(f"{len(log.results)} 試合分の結果から再開します")
+    started = time.perf_counter()
+    before = len(log.results)
+
+    def on_chunk(resolved):
+        elapsed = time.perf_counter() - started
+        print(f"  {resolved} 試合解決（{resolved / max(elapsed, 1e-6):.0f} 試合/秒）")
+
+    try:
+        if args.format == "bracket":
+            ranking = run_bracket(entrants, args.tournament_id, log, args.workers, on_chunk)
+        else:
+            ranking = run_round_robin(entrants, args.tournament_id, log, args.workers, args.group_size, on_chunk)
+    finally:
+        log.close()
+
+    elapsed = time.perf_counter() - started
+    played = len(log.results) - before
+    print(f"完了: {played} 試合を {elapsed:.1f} 秒で解決（{played / max(elapsed, 1e-6):.0f} 試合/秒）")
+    for rank, entrant_id in enumerate(ranking[:10], start=1):
+        print(f"{rank:>3}位 {entrants[entrant_id][1]} (id={entrant_id})")
+    return 0
+
+
+def run_bench(args) -> int:
+    """ワーカー数を増やしながら、総当たりの試合/秒を計測する"""
+    entrants = synthetic_entrants(args.synthetic)
+    matches = list(round_robin_matches(list(entrants), "bench", args.group_size))
+    print(f"出場者 {len(entrants)} 体 / {len(matches)} 試合")
+    print(f"{'workers':>8}{'秒':>10}{'試合/秒':>14}{'倍率':>8}")
+    baseline = None
+    workers = 1
+    results_path = "tournament_bench.results.jsonl"
+    while workers <= (args.max_workers or CPU_COUNT):
+        log = ResultLog(results_path, resume=False, meta={"bench": workers})
+        started = time.perf_counter()
+        resolve_all(matches, entrants, "bench", log, workers)
+        elapsed = time.perf_counter() - started
+        log.close()
+        rate = len(matches) / max(elapsed, 1e-6)
+        baseline = baseline or rate
+        print(f"{workers:>8}{elapsed:>10.2f}{rate:>14.0f}{rate / baseline:>8.2f}")
+        workers *= 2
+    os.remove(results_path)
+    os.remove(results_path + ".meta.json")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="保存済みキャラクターのトーナメント")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_run = sub.add_parser("run", help="トーナメントを実行する")
+    p_run.add_argument("tournament_id", help="トーナメントのID（対戦結果の乱数の種にもなる）")
+    p_run.add_argument("--format", choices=("bracket", "round-robin"), default="bracket")
+    p_run.add_argument("--group-size", type=int, default=32, help="総当たりのグループの人数（0で全員総当たり）")
+    p_run.add_argument("--workers", type=int, default=CPU_COUNT)
+    p_run.add_argument("--results", help="結果の JSON Lines のパス")
+    p_run.add_argument("--resume", action="store_true", help="保存済みの結果から再開する")
+    p_run.add_argument("--entrants", help="出場者を user_operations の行の JSON Lines から読む")
+    p_run.add_argument("--synthetic", type=int, help="ダミーの出場者を N 体作る（試験用）")
+
+    p_bench = sub.add_parser("bench", help="コア数ごとの試合/秒を計測する")
+    p_bench.add_argument("--synthetic", type=int, default=2000)
+    p_bench.add_argument("--group-size", type=int, default=0)
+    p_bench.add_argument("--max-workers", type=int)
+
+    args = parser.parse_args(argv)
+    return run_tournament(args) if args.command == "run" else run_bench(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,28 @@
+-- 図鑑エクスポート（ZIP）の置き場所
+-- 非公開バケット。各ユーザーは自分のフォルダ（<user_id>/）にだけ書き込める。
+-- ダウンロードはアプリが発行する署名付きURLで行う（ZIPをアプリのメモリに載せない）。
+
+insert into storage.buckets (id, name, public)
+values ('collection-exports', 'collection-exports', false)
+on conflict (id) do nothing;
+
+drop policy if exists "collection exports: own folder insert" on storage.objects;
+create policy "collection exports: own folder insert" on storage.objects
+    for insert to authenticated
+    with check (bucket_id = 'collection-exports' and (storage.foldername(name))[1] = auth.uid()::text);
+
+drop policy if exists "collection exports: own folder update" on storage.objects;
+create policy "collection exports: own folder update" on storage.objects
+    for update to authenticated
+    using (bucket_id = 'collection-exports' and (storage.foldername(name))[1] = auth.uid()::text);
+
+drop policy if exists "collection exports: own folder select" on storage.objects;
+create policy "collection exports: own folder select" on storage.objects
+    for select to authenticated
+    using (bucket_id = 'collection-exports' and (storage.foldername(name))[1] = auth.uid()::text);
+
+-- 大きな図鑑は複数のZIP（パート）に分けて上げるので、前回のパートを消せるようにする
+drop policy if exists "collection exports: own folder delete" on storage.objects;
+create policy "collection exports: own folder delete" on storage.objects
+    for delete to authenticated
+    using (bucket_id = 'collection-exports' and (storage.foldername(name))[1] = auth.uid()::text);
@@ -0,0 +1,10 @@
+-- character_parameter(JSON) の region / power を列に昇格する
+-- 実行後に `python main/backfill.py promote` で既存行を埋める
+-- ※ 列への絞り込み・並び替えへの切り替えの準備。アプリはまだ character_parameter 側を読み書きしている
+
+alter table public.user_operations
+    add column if not exists region text,
+    add column if not exists power integer;
+
+create index if not exists user_operations_user_region_idx on public.user_operations (user_id, region);
+create index if not exists user_operations_user_power_idx on public.user_operations (user_id, power);
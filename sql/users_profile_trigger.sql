@@ -0,0 +1,26 @@
+-- サインアップ時に users テーブルのプロフィールを作成するトリガー
+-- アプリからは supabase.auth.sign_up の1回だけでアカウントとプロフィールがそろう。
+-- user_name は sign_up の options.data.full_name（未入力ならメールアドレスの@より前）
+
+create or replace function public.handle_new_user()
+returns trigger
+language plpgsql
+security definer
+set search_path = public
+as $$
+begin
+    insert into public.users (user_id, mail_address, user_name)
+    values (
+        new.id,
+        new.email,
+        coalesce(nullif(new.raw_user_meta_data ->> 'full_name', ''), split_part(new.email, '@', 1))
+    )
+    on conflict (user_id) do nothing;
+    return new;
+end;
+$$;
+
+drop trigger if exists on_auth_user_created on auth.users;
+create trigger on_auth_user_created
+    after insert on auth.users
+    for each row execute function public.handle_new_user();
@@ -0,0 +1,71 @@
+#jan.py（桁数・チェックディジット・UPC→EAN-13 の正規化）のテスト
+# 実行: python -m pytest -q tests
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "main"))
+
+from jan import check_digit, explain_invalid, normalize_jan, normalize_many, upce_to_upca
+
+
+@pytest.mark.parametrize("raw, symbology, expected", [
+    ("4901234567894", None, "4901234567894"),        # EAN-13
+    ("96385074", None, "96385074"),                  # EAN-8
+    ("036000291452", None, "0036000291452"),         # UPC-A は先頭に0を付ける
+    ("04252614", "UPC-E", "0042100005264"),          # UPC-E は展開して EAN-13 に
+    ("04252614", "UPCE", "0042100005264"),
+    ("４９０１２３４-５６７８９４", None, "4901234567894"),  # 全角・区切り文字
+    (" 4901234567894 ", None, "4901234567894"),
+])
+def test_normalize_jan_valid(raw, symbology, expected):
+    assert normalize_jan(raw, symbology) == expected
+
+
+@pytest.mark.parametrize("raw, symbology", [
+    ("4901234567890", None),   # チェックディジット違い
+    ("036000291453", None),
+    ("04252614", None),        # UPC-E と言われなければ EAN-8 として検証する
+    ("24252614", "UPC-E"),     # UPC-E のナンバーシステムは 0 か 1
+    ("490123456789", None),    # 12桁だが UPC-A として不正
+    ("4901234", None),         # 桁数違い
+    ("49012345678a4", None),
+    ("", None),
+    (None, None),
+])
+def test_normalize_jan_invalid(raw, symbology):
+    assert normalize_jan(raw, symbology) is None
+
+
+def test_upce_to_upca():
+    assert upce_to_upca("04252614") == "042100005264"
+    assert upce_to_upca("01234565") == "012345000065"
+
+
+def test_check_digit():
+    assert check_digit("490123456789") == 4
+    assert check_digit("03600029145") == 2
+    assert check_digit("9638507") == 4
+
+
+def test_explain_invalid():
+    assert explain_invalid("4901234567894") == ""
+    assert "チェックディジット" in explain_invalid("4901234567890")
+    assert "桁" in explain_invalid("4901234")
+    assert "数字だけ" in explain_invalid("abc")
+    assert explain_invalid("") == "JANコードが入力されていません。"
+
+
+def test_normalize_many_matches_normalize_jan():
+    items = ["4901234567894", "4901234567890", "036000291452", "96385074",
+             "４９０１２３４５６７８９４", "490-1234567894", "4901234", "", None, 4901234567894]
+    for symbology in (None, "UPC-E", "EAN13"):
+        assert list(normalize_many(items, symbology=symbology)) == \
+            [(item, normalize_jan(item, symbology)) for item in items]
+
+
+def test_normalize_many_key():
+    rows = [{"jan": "036000291452"}, {"jan": "4901234567890"}]
+    assert [code for _, code in normalize_many(rows, key=lambda row: row["jan"])] == ["0036000291452", None]